@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import BaseHTTPServer
+import email.utils
+import os
+import re
+import shutil
+import SocketServer
+import sys
+import tempfile
+import urllib2
+import urlparse
+
+# package files are cached, the Release and Packages indexes are always
+# passed through.  Since the repos of the buildfarm rebuild packages under
+# the same file name, every cache hit is revalidated with the server.
+CACHEABLE_RE = re.compile(r'.*\.(deb|udeb|dsc|tar\.gz|tar\.bz2|tar\.xz|diff\.gz)$')
+
+DEFAULT_CACHE_DIR = '/var/cache/buildfarm-apt-proxy'
+DEFAULT_PORT = 3142
+
+CHUNK_SIZE = 1 << 16
+
+
+class CachingProxyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.scheme != 'http':
+            self.send_error(400, 'Only http proxy requests are supported')
+            return
+        cache_file = self.server.get_cache_file(url)
+        cached = cache_file and os.path.exists(cache_file)
+        request = self._get_request()
+        if cached:
+            request.add_header('If-Modified-Since', email.utils.formatdate(os.path.getmtime(cache_file), usegmt=True))
+        try:
+            response = urllib2.urlopen(request)
+        except urllib2.HTTPError as ex:
+            if cached and ex.code == 304:
+                self._send_file(cache_file)
+                return
+            response = ex
+        except urllib2.URLError as ex:
+            if cached:
+                # the server is not reachable, the cached file is all we have
+                self._send_file(cache_file)
+                return
+            self.send_error(502, str(ex.reason))
+            return
+        self.send_response(response.getcode())
+        for header in ['Content-Type', 'Content-Length', 'Last-Modified', 'ETag']:
+            if response.info().getheader(header):
+                self.send_header(header, response.info().getheader(header))
+        self.end_headers()
+        if cache_file and response.getcode() == 200:
+            self._copy_to_cache(response, cache_file)
+        else:
+            shutil.copyfileobj(response, self.wfile, CHUNK_SIZE)
+
+    def _get_request(self):
+        request = urllib2.Request(self.path)
+        if not self.server.get_cache_file(urlparse.urlparse(self.path)):
+            for header in ['If-Modified-Since', 'If-None-Match', 'Range']:
+                if self.headers.getheader(header):
+                    request.add_header(header, self.headers.getheader(header))
+        return request
+
+    def _send_file(self, cache_file):
+        with open(cache_file, 'rb') as f:
+            self.send_response(200)
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+
+    def _copy_to_cache(self, response, cache_file):
+        """ Stream the response to the client while writing it to the
+        cache.  The file is only moved into the cache once it is complete
+        so concurrent requests never see a partial file. """
+        cache_dir = os.path.dirname(cache_file)
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                if not os.path.isdir(cache_dir):
+                    raise
+        fd, tmp_file = tempfile.mkstemp(dir=cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    self.wfile.write(chunk)
+            # the mtime is sent as If-Modified-Since when revalidating
+            last_modified = response.info().getheader('Last-Modified')
+            if last_modified and email.utils.parsedate_tz(last_modified):
+                mtime = email.utils.mktime_tz(email.utils.parsedate_tz(last_modified))
+                os.utime(tmp_file, (mtime, mtime))
+            os.rename(tmp_file, cache_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+
+class CachingProxyServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ A http proxy for apt which keeps the downloaded package files in
+    a directory so that repeated builds on a node download them only
+    once. """
+
+    daemon_threads = True
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, host='localhost', port=DEFAULT_PORT):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), CachingProxyHandler)
+        self.cache_dir = os.path.abspath(cache_dir)
+
+    def get_cache_file(self, url):
+        """ The cache file for a parsed url, None if it is not cached """
+        if not CACHEABLE_RE.match(url.path):
+            return None
+        path = os.path.normpath(os.path.join(self.cache_dir, url.netloc, url.path.lstrip('/')))
+        if not path.startswith(self.cache_dir + os.sep):
+            return None
+        return path
+
+
+def get_proxy_url(host='localhost', port=DEFAULT_PORT):
+    return 'http://%s:%d/' % (host, port)
+
+
+def run_proxy(cache_dir=DEFAULT_CACHE_DIR, host='localhost', port=DEFAULT_PORT):
+    server = CachingProxyServer(cache_dir, host, port)
+    print('Serving apt proxy on %s caching in %s' % (get_proxy_url(host, port), cache_dir), file=sys.stderr)
+    server.serve_forever()
@@ -2,15 +2,39 @@
 
 from __future__ import print_function
 
+import errno
+import hashlib
 import pkg_resources
 import em
 import os
 
 
+_templates = {}
+
 def expand_template(config_template, d):
     s = em.expand(config_template, **d)
     return s
 
+def get_template(name):
+    if name not in _templates:
+        _templates[name] = pkg_resources.resource_string('buildfarm', 'resources/templates/%s' % name)
+    return _templates[name]
+
+def write_if_changed(path, content):
+    """ Write content to path unless the file already contains it.
+    Leaving unchanged files alone keeps the timestamps apt uses to
+    decide whether its lists are still valid.  Returns True if the
+    file has been written. """
+    try:
+        with open(path, 'r') as f:
+            if f.read() == content:
+                return False
+    except IOError:
+        pass
+    with open(path, 'w') as f:
+        f.write(content)
+    return True
+
 def setup_directories(rootdir):
     """ Create the directories needed to use apt with an alternate
     rootdir """
@@ -32,14 +56,13 @@ def setup_directories(rootdir):
                 continue
             raise ex
 
-def setup_conf(rootdir, target_dir):
+def setup_conf(rootdir, target_dir, proxy=None):
     """ Set the apt.conf config settings for the specific
     architecture. """
 
-    d = {'rootdir':rootdir}
-    with open(os.path.join(target_dir, "apt.conf"), 'w') as apt_conf:
-        template = pkg_resources.resource_string('buildfarm', 'resources/templates/apt.conf.em')
-        apt_conf.write(expand_template(template, d))
+    d = {'rootdir':rootdir, 'proxy':proxy}
+    return write_if_changed(os.path.join(target_dir, "apt.conf"),
+                            expand_template(get_template('apt.conf.em'), d))
 
 
 
@@ -48,34 +71,178 @@ def set_default_sources(rootdir, distro, repo, arch):
     d = {'distro':distro,
          'arch':arch,
          'repo': repo}
-    with open(os.path.join(rootdir, "etc/apt/sources.list"), 'w') as sources_list:
-        template = pkg_resources.resource_string('buildfarm', 'resources/templates/sources.list.em')
-        sources_list.write(expand_template(template, d))
+    return write_if_changed(os.path.join(rootdir, "etc/apt/sources.list"),
+                            expand_template(get_template('sources.list.em'), d))
+
+def get_additional_sources_list(rootdir, source_name):
+    return os.path.join(rootdir, "etc/apt/sources.list.d/%s.list"%source_name)
 
 def set_additional_sources(rootdir, distro, repo, source_name):
     """ Set the source lists for the default ubuntu and ros sources """
     d = {'distro':distro, 
          'repo': repo}
-    with open(os.path.join(rootdir, "etc/apt/sources.list.d/%s.list"%source_name), 'w') as sources_list:
-        template = pkg_resources.resource_string('buildfarm', 'resources/templates/ros-sources.list.em')
-        sources_list.write(expand_template(template, d))
+    return write_if_changed(get_additional_sources_list(rootdir, source_name),
+                            expand_template(get_template('ros-sources.list.em'), d))
     
 
-def setup_apt_rootdir(rootdir, distro, arch, mirror=None, additional_repos = {}):
+def setup_apt_rootdir(rootdir, distro, arch, mirror=None, additional_repos = {}, proxy=None):
+    """ Set up rootdir for apt.  Files which are already up to date are
+    not touched.  Returns True if any configuration file has changed. """
     setup_directories(rootdir)
     if not mirror:
         repo='http://us.archive.ubuntu.com/ubuntu/'
     else:
         repo = mirror
-    set_default_sources(rootdir, distro, repo, arch)
+    changed = set_default_sources(rootdir, distro, repo, arch)
     for repo_name, repo_url in additional_repos.iteritems():
-        set_additional_sources(rootdir, distro, repo_url, repo_name)
+        changed |= set_additional_sources(rootdir, distro, repo_url, repo_name)
 
     d = {'arch':arch}
     path = os.path.join(rootdir, "etc/apt/apt.conf.d/51Architecture")
-    with open(path, 'w') as arch_conf:
-        template = pkg_resources.resource_string('buildfarm', 'resources/templates/arch.conf.em')
-        arch_conf.write(expand_template(template, d))
+    changed |= write_if_changed(path, expand_template(get_template('arch.conf.em'), d))
+
+    # download packages through a caching proxy like buildfarm.apt_proxy
+    path = os.path.join(rootdir, "etc/apt/apt.conf.d/52Proxy")
+    if proxy:
+        changed |= write_if_changed(path, expand_template(get_template('proxy.conf.em'), {'proxy':proxy}))
+    elif os.path.exists(path):
+        os.remove(path)
+        changed = True
+    return changed
+
+
+def has_lists(rootdir):
+    """ Whether apt has already downloaded package lists into rootdir """
+    lists_dir = os.path.join(rootdir, "var/lib/apt/lists")
+    return any(f.endswith('_Packages') for f in os.listdir(lists_dir)) if os.path.isdir(lists_dir) else False
+
+def update_cache(cache, rootdir, source_names=None):
+    """ Update the lists of an apt.Cache opened with rootdir and reopen
+    it.  If source_names is given only the lists of these additional
+    sources, e.g. the ROS repositories, are fetched and the lists of
+    all other sources are kept. """
+    if source_names is None:
+        cache.update()
+    else:
+        for source_name in source_names:
+            cache.update(sources_list=get_additional_sources_list(rootdir, source_name))
+    # Have to open the cache again after updating.
+    cache.open()
+
+
+# The lists of the same mirror are identical in all rootdirs using it.  A
+# list pool keeps every list file once under its sha256 in objects/ and
+# remembers the latest content for each list file name in names/.  The
+# rootdirs get hardlinks to the pooled files; apt replaces list files by
+# renaming new downloads over them, so a shared file is never modified.
+
+def _hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+def _get_list_files(rootdir):
+    lists_dir = os.path.join(rootdir, "var/lib/apt/lists")
+    if not os.path.isdir(lists_dir):
+        return []
+    return [os.path.join(lists_dir, f) for f in sorted(os.listdir(lists_dir))
+            if f != 'lock' and os.path.isfile(os.path.join(lists_dir, f))
+            and not os.path.islink(os.path.join(lists_dir, f))]
+
+def _link_over(src, dst):
+    """ Atomically replace dst by a hardlink to src.  Returns False if
+    they are on different filesystems. """
+    tmp = dst + '.pool-tmp'
+    try:
+        os.link(src, tmp)
+    except OSError, ex:
+        if ex.errno == errno.EXDEV:
+            return False
+        raise
+    os.rename(tmp, dst)
+    return True
+
+def _get_list_prefixes(rootdir):
+    """ The prefixes of the names apt gives to the lists of the sources
+    configured in rootdir, e.g. 'host_ubuntu_dists_precise_' """
+    etc = os.path.join(rootdir, "etc/apt")
+    sources = [os.path.join(etc, "sources.list")]
+    if os.path.isdir(os.path.join(etc, "sources.list.d")):
+        sources += [os.path.join(etc, "sources.list.d", f) for f in os.listdir(os.path.join(etc, "sources.list.d"))
+                    if f.endswith('.list')]
+    prefixes = set()
+    for source in sources:
+        if not os.path.isfile(source):
+            continue
+        with open(source, 'r') as f:
+            for l in f:
+                fields = l.split()
+                if len(fields) >= 3 and fields[0] in ['deb', 'deb-src']:
+                    uri = fields[1].split('://', 1)[-1].rstrip('/')
+                    prefixes.add(('%s/dists/%s/' % (uri, fields[2])).replace('/', '_'))
+    return prefixes
+
+def seed_lists(rootdir, pool_dir):
+    """ Hardlink the pooled list files of the sources of rootdir which it
+    does not have yet into it.  apt then only asks the mirror whether
+    they have been modified instead of downloading them again. """
+    names_dir = os.path.join(pool_dir, 'names')
+    if not os.path.isdir(names_dir):
+        return
+    lists_dir = os.path.join(rootdir, "var/lib/apt/lists")
+    prefixes = tuple(_get_list_prefixes(rootdir))
+    for name in os.listdir(names_dir):
+        if not name.startswith(prefixes):
+            continue
+        dst = os.path.join(lists_dir, name)
+        src = os.path.realpath(os.path.join(names_dir, name))
+        if not os.path.exists(dst) and os.path.exists(src):
+            _link_over(src, dst)
+
+def pool_lists(rootdir, pool_dir):
+    """ Move the list files of rootdir into the pool, replacing files
+    with the same content by hardlinks to a single copy. """
+    objects_dir = os.path.join(pool_dir, 'objects')
+    names_dir = os.path.join(pool_dir, 'names')
+    for d in [objects_dir, names_dir]:
+        if not os.path.isdir(d):
+            os.makedirs(d)
+    for path in _get_list_files(rootdir):
+        obj = os.path.join(objects_dir, _hash_file(path))
+        if not os.path.exists(obj):
+            if not _link_over(path, obj):
+                continue
+        elif not os.path.samefile(path, obj):
+            # keep the newest timestamp, apt uses it for If-Modified-Since
+            mtime = max(os.stat(path).st_mtime, os.stat(obj).st_mtime)
+            if not _link_over(obj, path):
+                continue
+            os.utime(obj, (mtime, mtime))
+        name = os.path.join(names_dir, os.path.basename(path))
+        target = os.path.join('..', 'objects', os.path.basename(obj))
+        if not os.path.islink(name) or os.readlink(name) != target:
+            os.symlink(target, name + '.pool-tmp')
+            os.rename(name + '.pool-tmp', name)
+
+def prune_list_pool(pool_dir):
+    """ Remove the pooled list files no rootdir links to anymore. """
+    objects_dir = os.path.join(pool_dir, 'objects')
+    names_dir = os.path.join(pool_dir, 'names')
+    if os.path.isdir(objects_dir):
+        for f in os.listdir(objects_dir):
+            obj = os.path.join(objects_dir, f)
+            if os.stat(obj).st_nlink == 1:
+                os.remove(obj)
+    if os.path.isdir(names_dir):
+        for f in os.listdir(names_dir):
+            name = os.path.join(names_dir, f)
+            if not os.path.exists(name):
+                os.remove(name)
 
 
 def parse_repo_args(repo_args):
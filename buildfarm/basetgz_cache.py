@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+# the option passing the build root to each backend and the suffix of the
+# cached build roots: pbuilder unpacks a base tarball for every run while
+# cowbuilder keeps the base unpacked and builds in a copy-on-write
+# hardlink farm of it
+BACKENDS = {
+    'pbuilder': ('--basetgz', '.tgz'),
+    'cowbuilder': ('--basepath', '.cow'),
+}
+
+
+# bases beyond max_cached are only removed once they have not been used
+# for this long, so that running builds never lose their base
+MIN_UNUSED_AGE = 24 * 3600
+
+
+def get_base_option(backend):
+    return BACKENDS[backend][0]
+
+
+def get_basetgz_path(cache_dir, distro, arch, options, create_options=[], backend='pbuilder'):
+    """ The path of the base tarball (or base directory for cowbuilder)
+    for distro and arch which is set up with the given pbuilder options.
+    The name contains a hash of all these inputs so that any change to
+    them selects a different tarball. """
+    key = json.dumps([distro, arch, options, create_options])
+    digest = hashlib.sha1(key).hexdigest()[:12]
+    return os.path.join(cache_dir, '%s-%s-%s%s' % (distro, arch, digest, BACKENDS[backend][1]))
+
+
+def setup_basetgz(cache_dir, distro, arch, options, create_options=[], update=False, max_cached=3, stdout=None, backend='pbuilder', proxy=None, min_unused_age=MIN_UNUSED_AGE):
+    """ Make sure the base tarball for the given inputs exists and
+    return its path.
+
+    An existing tarball is reused, with update it is refreshed with
+    'pbuilder --update' first.  Otherwise the most recently used
+    tarball of the same distro and arch is copied and brought up to
+    date with 'pbuilder --update', only if there is none a new one is
+    bootstrapped with 'pbuilder --create'.  Afterwards the tarballs of
+    the distro and arch beyond the max_cached most recently used ones
+    are removed if they have not been used for min_unused_age seconds.
+    All of this happens under a lock shared by all processes using the
+    cache_dir for this distro and arch.
+
+    options are passed to pbuilder when creating or updating the
+    tarball (mirrors, components, extra packages, ...), create_options
+    only when creating it (debootstrap options).  The proxy is passed to
+    pbuilder as well but does not select a different tarball.  With the
+    cowbuilder backend the same applies to unpacked base directories. """
+    basetgz = get_basetgz_path(cache_dir, distro, arch, options, create_options, backend)
+    if not os.path.isdir(cache_dir):
+        subprocess.check_call(['sudo', 'mkdir', '-p', cache_dir], stdout=stdout)
+    lock = _lock(cache_dir, distro, arch, stdout)
+    try:
+        _setup_basetgz(basetgz, cache_dir, distro, arch, options + (['--http-proxy', proxy] if proxy else []), create_options, update, stdout, backend)
+        now = time.time()
+        for p in get_cached_basetgzs(cache_dir, distro, arch, backend)[max_cached:]:
+            if now - os.path.getmtime(p) < min_unused_age:
+                continue
+            print('Removing least recently used base %s' % p, file=sys.stderr)
+            subprocess.check_call(['sudo', 'rm', '-rf', p], stdout=stdout)
+    finally:
+        os.close(lock)
+    return basetgz
+
+
+def _setup_basetgz(basetgz, cache_dir, distro, arch, options, create_options, update, stdout, backend):
+    base_option = get_base_option(backend)
+    if _base_exists(basetgz):
+        if update:
+            subprocess.check_call(['sudo', backend, '--update', base_option, basetgz], stdout=stdout)
+        else:
+            # remember when the tarball was used last
+            subprocess.check_call(['sudo', 'touch', basetgz], stdout=stdout)
+    else:
+        # zero sized files are left in place if the last build crashed
+        subprocess.check_call(['sudo', 'rm', '-rf', basetgz], stdout=stdout)
+        previous = [p for p in get_cached_basetgzs(cache_dir, distro, arch, backend) if p != basetgz]
+        if not previous or not _update_basetgz(previous[0], basetgz, distro, options, stdout, backend):
+            print('Creating base %s' % basetgz, file=sys.stderr)
+            subprocess.check_call(['sudo', backend, '--create', '--distribution', distro, base_option, basetgz] + options + create_options, stdout=stdout)
+
+
+def get_cached_basetgzs(cache_dir, distro, arch, backend='pbuilder'):
+    """ The usable base tarballs of distro and arch, most recently used
+    first. """
+    paths = glob.glob(os.path.join(cache_dir, '%s-%s-*%s' % (distro, arch, BACKENDS[backend][1])))
+    return sorted([p for p in paths if _base_exists(p)], key=os.path.getmtime, reverse=True)
+
+
+def _lock(cache_dir, distro, arch, stdout):
+    """ Lock the bases of distro and arch against other processes.
+    The cache_dir usually belongs to root, a lock can be taken on a file
+    opened for reading only.  Returns the file descriptor to close for
+    releasing the lock. """
+    lock_file = os.path.join(cache_dir, '.%s-%s.lock' % (distro, arch))
+    if not os.path.exists(lock_file):
+        subprocess.check_call(['sudo', 'touch', lock_file], stdout=stdout)
+    fd = os.open(lock_file, os.O_RDONLY)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    return fd
+
+
+def _base_exists(path):
+    if os.path.isdir(path):
+        return len(os.listdir(path)) > 0
+    return os.path.exists(path) and os.path.getsize(path) > 0
+
+
+def _update_basetgz(previous, basetgz, distro, options, stdout, backend):
+    print('Updating base %s to %s' % (previous, basetgz), file=sys.stderr)
+    try:
+        # a full copy, updating a hardlinked copy would modify the previous one as well
+        subprocess.check_call(['sudo', 'cp', '-a', previous, basetgz], stdout=stdout)
+        subprocess.check_call(['sudo', backend, '--update', '--override-config', '--distribution', distro, get_base_option(backend), basetgz] + options, stdout=stdout)
+    except subprocess.CalledProcessError as ex:
+        print('Updating base failed, creating it instead: %s' % ex, file=sys.stderr)
+        subprocess.call(['sudo', 'rm', '-rf', basetgz], stdout=stdout)
+        return False
+    return True
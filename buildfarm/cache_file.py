@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+
+
+def write_cache_file(cache_file, text):
+    """
+    Write text to cache_file through a temporary file in the same
+    directory which is then renamed, so that concurrent readers never see
+    a partially written file.  Failing to write a cache is not fatal, a
+    warning is printed instead.
+
+    :returns: True if the cache file has been written
+    """
+    tmp_file = None
+    try:
+        cache_dir = os.path.dirname(cache_file) or '.'
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        fd, tmp_file = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.rename(tmp_file, cache_file)
+        return True
+    except (IOError, OSError) as ex:
+        print('Could not cache "%s": %s' % (cache_file, ex), file=sys.stderr)
+        if tmp_file and os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        return False
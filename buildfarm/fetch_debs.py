@@ -3,11 +3,14 @@
 import apt
 import os
 import argparse
+import hashlib
 import tempfile
 import shutil
 import sys
+import urllib2
+from multiprocessing.pool import ThreadPool
 
-import setup_apt_root
+import buildfarm.apt_root as setup_apt_root
 
 def parse_options():
     parser = argparse.ArgumentParser(description="List all packages available in the repos for each arch.  Filter on substring if provided")
@@ -21,6 +24,8 @@ def parse_options():
            help='The name for the source and the url such as ros@http://50.28.27.175/repos/building')
     parser.add_argument('--destdir', dest='dest_dir', action='store', default = '.',
            help='What directory to download the debs into. Default: "." ')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=8,
+           help='How many debs to download in parallel. Default: 8')
 
     args = parser.parse_args()
 
@@ -39,7 +44,7 @@ def parse_options():
 
     return args
 
-def list_packages(rootdir, update, substring):
+def open_cache(rootdir, update):
     c = apt.Cache(rootdir=rootdir)
     c.open()
 
@@ -47,28 +52,78 @@ def list_packages(rootdir, update, substring):
         c.update()
 
     c.open() # required to recall open after updating or you will query the old data
-
-    packages = []
-    for p in [k for k in c.keys() if args.substring in k]:
-        packages.append(p)
-
-    return packages
-
-def get_packages(rootdir, update, substring, dest_dir = '.'):
-    c = apt.Cache(rootdir=rootdir)
-    c.open()
-
-    if update:
-        c.update()
-
-    c.open() # required to recall open after updating or you will query the old data
-
-    for p in [k for k in c.keys() if args.substring in k]:
-        pack = c[p]
-        v = pack.candidate #versions[0]
-        print "fetching packge", p, " for arch",v.architecture, 
-        # This is going to throw some nasty tracebacks but it's just for the screen printing. https://bugs.launchpad.net/ubuntu/+source/apt/+bug/684785
-        v.fetch_binary(destdir=dest_dir) 
+    return c
+
+def list_packages(cache, substring):
+    return [k for k in cache.keys() if substring in k]
+
+def get_download_items(cache, substring):
+    """ Resolve the urls and checksums of the candidates of all packages
+    matching substring.  Returns a list of (url, filename, size,
+    checksum_type, checksum) """
+    items = []
+    for p in list_packages(cache, substring):
+        v = cache[p].candidate
+        if v is None or not v.uri:
+            continue
+        sha256 = getattr(v, 'sha256', None)
+        if sha256:
+            checksum = ('sha256', sha256)
+        else:
+            checksum = ('md5', v.md5)
+        items.append((v.uri, os.path.basename(v.filename), v.size) + checksum)
+    return items
+
+def _hash_file(path, checksum_type):
+    h = hashlib.new(checksum_type)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1 << 16)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+def download_deb(item, dest_dir):
+    """ Download a deb unless it is already in dest_dir with the right
+    checksum.  An interrupted download is resumed from its .part file.
+    Returns None on success or an error message. """
+    url, filename, size, checksum_type, checksum = item
+    dest = os.path.join(dest_dir, filename)
+    if os.path.exists(dest) and _hash_file(dest, checksum_type) == checksum:
+        return None
+    part = dest + '.part'
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    if offset >= size:
+        offset = 0
+    try:
+        request = urllib2.Request(url)
+        if offset:
+            request.add_header('Range', 'bytes=%d-' % offset)
+        response = urllib2.urlopen(request)
+        # servers not supporting ranges send the whole file
+        mode = 'ab' if offset and response.getcode() == 206 else 'wb'
+        with open(part, mode) as f:
+            shutil.copyfileobj(response, f, 1 << 16)
+    except (urllib2.URLError, IOError), ex:
+        return "failed to download %s: %s" % (url, ex)
+    if _hash_file(part, checksum_type) != checksum:
+        os.remove(part)
+        return "%s checksum mismatch for %s" % (checksum_type, url)
+    os.rename(part, dest)
+    return None
+
+def download_debs(items, dest_dir, jobs=8):
+    """ Download debs in parallel, each file only once.  Returns the
+    list of error messages. """
+    unique_items = dict((item[1], item) for item in items).values()
+    pool = ThreadPool(jobs)
+    try:
+        results = pool.map(lambda item: download_deb(item, dest_dir), unique_items, 1)
+    finally:
+        pool.close()
+        pool.join()
+    return [r for r in results if r]
 
 
 def render_vertical(packages):
@@ -115,6 +170,7 @@ if __name__ == "__main__":
 
     packages = {}
 
+    caches = {}
     try:
         for d in distros:
             for a in arches:
@@ -123,7 +179,8 @@ if __name__ == "__main__":
                 setup_apt_root.setup_apt_rootdir(specific_rootdir, d, a, additional_repos = ros_repos)
                 print "setup rootdir %s"%specific_rootdir
                 
-                packages[dist_arch] = list_packages(specific_rootdir, update=True, substring=args.substring)
+                caches[dist_arch] = open_cache(specific_rootdir, update=True)
+                packages[dist_arch] = list_packages(caches[dist_arch], args.substring)
 
         render_vertical(packages)
 
@@ -134,19 +191,15 @@ if __name__ == "__main__":
             print "doesn't start with y"
             sys.exit(0)
 
-        for d in distros:
-            for a in arches:
-                dist_arch = "%s_%s"%(d, a)
-                specific_rootdir = os.path.join(rootdir, dist_arch)
-                setup_apt_root.setup_apt_rootdir(specific_rootdir, d, a, additional_repos = ros_repos)
-                print "setup rootdir %s"%specific_rootdir
-                
-                get_packages(specific_rootdir, update=True, substring=args.substring, dest_dir = args.dest_dir)
-            
-            
-
-
-        
+        items = []
+        for dist_arch, cache in caches.iteritems():
+            items.extend(get_download_items(cache, args.substring))
+        print "fetching %d debs" % len(items)
+        errors = download_debs(items, args.dest_dir, args.jobs)
+        for e in errors:
+            print >> sys.stderr, e
+        if errors:
+            sys.exit(1)
                 
     finally:
         if not args.rootdir: # don't delete if it's not a tempdir
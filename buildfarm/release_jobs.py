@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-from __future__ import print_function
+from __future__ import absolute_import, print_function
 import em
 import pkg_resources
 import os
@@ -8,13 +8,14 @@ import re
 import sys
 from xml.sax.saxutils import escape
 import xml.etree.ElementTree as ET
-import urllib
 import urllib2
-import yaml
 import datetime
 
 from rospkg.distro import load_distro, distro_uri
+from rosdep2 import rospack
+from rosdistro.rosdistro import RosDistro
 from . import repo, jenkins_support
+from .stack_info import load_stack_info, prefetch_stack_infos
 
 import jenkins
 
@@ -157,8 +158,7 @@ def check_for_circular_dependencies(dependencies):
 
 # dry dependencies
 def dry_get_stack_info(stackname, version):
-    y = urllib.urlopen('https://code.ros.org/svn/release/download/stacks/%(stackname)s/%(stackname)s-%(version)s/%(stackname)s-%(version)s.yaml' % locals())
-    return yaml.load(y.read())
+    return load_stack_info(stackname, version)
 
 
 def dry_get_stack_version(stackname, rosdistro_obj):
@@ -178,6 +178,7 @@ def dry_get_versioned_dependency_tree(rosdistro):
     dependency_tree = {}
     versions = {}
     maintainer_dict = {}
+    prefetch_stack_infos([(s, d.stacks[s].version) for s in d.stacks])
     for s in d.stacks:
         version = d.stacks[s].version
         versions[s] = version
@@ -224,6 +225,75 @@ def dry_generate_jobgraph(rosdistro, wet_jobgraph, stack_depends):
     return jobgraph
 
 
+def get_ros_dependency_names(names, released_names):
+    """
+    Returns the subset of the dependency names which are not system
+    dependencies.  Released packages are ROS dependencies, only the other
+    names are looked up in the rosdep database, each of them once.
+    """
+    ros_names = set()
+    v = None
+    for d in set(names):
+        if d in released_names:
+            ros_names.add(d)
+            continue
+        if v is None:
+            v = rospack.init_rospack_interface()
+        if not rospack.is_system_dependency(v, d):
+            ros_names.add(d)
+    return ros_names
+
+
+def get_dependencies(rd, packages):
+    """
+    Returns the jobgraph of the wet packages, mapping the debian name of
+    each package to the debian names of the ROS packages it depends on.
+    """
+    combined_deps = {}
+    for p in packages:
+        deps = rd.get_depends(p)
+        combined_deps[p] = set(deps['build']) | set(deps['run'])
+
+    all_deps = set()
+    for deps in combined_deps.itervalues():
+        all_deps.update(deps)
+    ros_names = get_ros_dependency_names(all_deps, set(packages))
+
+    dependencies = {}
+    for p, deps in combined_deps.iteritems():
+        dependencies[debianize_package_name(rd.name, p)] = [debianize_package_name(rd.name, d) for d in deps if d in ros_names]
+    return dependencies
+
+
+def combine_jobgraphs(rosdistro, wet_jobgraph, dry_jobgraph=None):
+    combined_jobgraph = {}
+    for k, v in wet_jobgraph.iteritems():
+        combined_jobgraph[k] = v
+    if dry_jobgraph:
+        for k, v in dry_jobgraph.iteritems():
+            combined_jobgraph[k] = v
+
+    # setup a job triggered by all other debjobs
+    combined_jobgraph[debianize_package_name(rosdistro, 'metapackages')] = combined_jobgraph.keys()
+    return combined_jobgraph
+
+
+def get_jobgraph(rosdistro, rosdist_rep):
+    """
+    Returns the combined wet and dry jobgraph of the release jobs of a
+    rosdistro, the same way create_release_jobs.py computes it.  The wet
+    packages of fuerte are not considered.
+    """
+    if rosdistro != 'fuerte':
+        rd = RosDistro(rosdistro, rosdist_rep=rosdist_rep)
+        dependencies = get_dependencies(rd, rd.get_packages())
+    else:
+        dependencies = {}
+    stack_depends, _ = dry_get_stack_dependencies(rosdistro)
+    dry_jobgraph = dry_generate_jobgraph(rosdistro, dependencies, stack_depends)
+    return combine_jobgraphs(rosdistro, dependencies, dry_jobgraph)
+
+
 def compare_configs(a, b):
     """Return True if the configs are the same, except the
     description, else False"""
@@ -1,3 +1,6 @@
 @{import os}
 Dir::Etc @os.path.join(rootdir, 'etc/apt');
 Dir::State @os.path.join(rootdir, 'var/lib/apt');
+@[if proxy]
+Acquire::http::Proxy "@(proxy)";
+@[end if]
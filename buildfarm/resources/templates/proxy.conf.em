@@ -0,0 +1 @@
+Acquire::http::Proxy "@(proxy)";
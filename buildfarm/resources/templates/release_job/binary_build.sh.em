@@ -12,12 +12,8 @@ base=/var/cache/pbuilder-$distro-$arch
 
 aptconffile=$WORKSPACE/apt.conf
 
-#increment this value if you have changed something that will invalidate base tarballs. #TODO this will need cleanup eventually.
-basetgz_version=5
+rootdir=$base/apt-conf
 
-rootdir=$base/apt-conf-$basetgz_version
-
-basetgz=$base/base-$basetgz_version.tgz
 output_dir=$WORKSPACE/output
 work_dir=$WORKSPACE/work
 
@@ -79,24 +75,8 @@ echo "package name ${PACKAGE} version ${version}"
 
 
 # Setup the pbuilder environment if not existing, or update
-if [ ! -e $basetgz ] || [ ! -s $basetgz ] 
-then
-  #make sure the base dir exists
-  sudo mkdir -p $base
-  #create the base image
-  sudo pbuilder create \
-    --distribution $distro \
-    --aptconfdir $rootdir/etc/apt \
-    --basetgz $basetgz \
-    --architecture $arch \
-    --mirror $mirror \
-    --keyring /etc/apt/trusted.gpg \
-    --debootstrap $debootstrap_type \
-    --debootstrapopts --arch=$arch \
-    --debootstrapopts --keyring=/etc/apt/trusted.gpg
-else
-  sudo pbuilder --update --basetgz $basetgz
-fi
+# the base tarballs are cached by a hash of their configuration
+basetgz=`sudo PYTHONPATH=$PYTHONPATH $WORKSPACE/catkin-debs/scripts/setup_basetgz.py $distro $arch $base --update --mirror $mirror --debootstrap $debootstrap_type --aptconfdir $rootdir/etc/apt`
 
 
 # hooks for changing the binary debs to be timestamped
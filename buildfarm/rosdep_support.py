@@ -32,11 +32,34 @@
 
 from __future__ import print_function
 
+import threading
+
 from rospkg.os_detect import OS_UBUNTU
 from rosdep2.catkin_support import get_catkin_view, get_installer, resolve_for_os
 from rosdep2.platforms.debian import APT_INSTALLER
 #NOTE: this code is very similar to code in catkin-generate-distribution and rosrelease
 
+# loading a rosdep view reads the whole rosdep database, so keep one view
+# per (rosdistro, os, platform) for the lifetime of the process
+_views = {}
+_apt_installer = None
+_lock = threading.Lock()
+
+def get_rosdep_view(rosdistro_name, os_name, os_platform):
+    key = (rosdistro_name, os_name, os_platform)
+    with _lock:
+        if key not in _views:
+            # rosdep view is our view into the rosdep database
+            _views[key] = get_catkin_view(rosdistro_name, os_name, os_platform)
+        return _views[key]
+
+def get_apt_installer():
+    global _apt_installer
+    with _lock:
+        if _apt_installer is None:
+            _apt_installer = get_installer(APT_INSTALLER)
+        return _apt_installer
+
 def resolve_rosdeps(rosdep_keys, rosdistro_name, os_name, os_platform):
     """
     :raises: :exc:`rosdep2.catkin_support.ValidationFailed`
@@ -50,13 +73,12 @@ def resolve_rosdeps(rosdep_keys, rosdistro_name, os_name, os_platform):
     # use the catkin_support module in rosdep2 as it does the same business
 
     # apt-install resolves data
-    apt_installer = get_installer(APT_INSTALLER)
-    # rosdep view is our view into the rosdep database
-    rosdep_view = get_catkin_view(rosdistro_name, os_name, os_platform)
+    apt_installer = get_apt_installer()
+    rosdep_view = get_rosdep_view(rosdistro_name, os_name, os_platform)
 
     # iterate through all our keys to resolve
     ubuntu_deps = set()
-    for dep in rosdep_keys:
+    for dep in set(rosdep_keys):
         resolved = resolve_for_os(dep, rosdep_view, apt_installer, os_name, os_platform)
         ubuntu_deps.update(resolved)
     return list(ubuntu_deps)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import os
+import tempfile
+import threading
+import urllib2
+import yaml
+
+from multiprocessing.pool import ThreadPool
+
+from buildfarm.cache_file import write_cache_file
+
+STACK_YAML_URL = 'https://code.ros.org/svn/release/download/stacks/%(stack_name)s/%(stack_name)s-%(stack_version)s/%(stack_name)s-%(stack_version)s.yaml'
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'stack-info-cache')
+
+
+def stack_info_url(stack_name, stack_version):
+    return STACK_YAML_URL % locals()
+
+
+def parse_stack_info(text, source):
+    """
+    :raises: :exc:`ValueError` if text is not a valid stack yaml
+    """
+    try:
+        info = yaml.load(text)
+    except yaml.YAMLError as ex:
+        raise ValueError('Invalid stack yaml "%s": %s' % (source, ex))
+    if not isinstance(info, dict):
+        raise ValueError('Invalid stack yaml "%s": not a dictionary' % source)
+    return info
+
+
+class StackInfoLoader(object):
+    """
+    Loads the <stack>-<version>.yaml files of released dry stacks.  Since
+    the file of a released version never changes it is kept forever in an
+    on-disk cache (and parsed only once per process).
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._infos = {}
+        self._lock = threading.Lock()
+
+    def get_cache_file(self, stack_name, stack_version):
+        return os.path.join(self.cache_dir, '%s-%s.yaml' % (stack_name, stack_version))
+
+    def load(self, stack_name, stack_version):
+        """
+        :raises: :exc:`urllib2.URLError` if the yaml file can not be fetched
+        :raises: :exc:`ValueError` if the fetched file is not a valid stack yaml
+        """
+        key = (stack_name, stack_version)
+        with self._lock:
+            if key in self._infos:
+                return self._infos[key]
+        info = self._get_info(stack_name, stack_version)
+        with self._lock:
+            return self._infos.setdefault(key, info)
+
+    def prefetch(self, stacks, jobs=8):
+        """
+        Fetch the yaml files of all (stack_name, stack_version) pairs which
+        are not cached yet concurrently.  Failures are ignored here, they
+        are reported when the stack is actually loaded.
+        """
+        missing = [(s, v) for s, v in stacks if v and not os.path.exists(self.get_cache_file(s, v))]
+        if not missing:
+            return
+        pool = ThreadPool(min(jobs, len(missing)))
+        try:
+            pool.map(self._try_fetch, missing)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _try_fetch(self, stack):
+        try:
+            self.load(*stack)
+        except (urllib2.URLError, ValueError):
+            pass
+
+    def _get_info(self, stack_name, stack_version):
+        cache_file = self.get_cache_file(stack_name, stack_version)
+        if os.path.exists(cache_file):
+            with open(cache_file, 'r') as f:
+                text = f.read()
+            try:
+                return parse_stack_info(text, cache_file)
+            except ValueError:
+                # damaged cache file, fetch it again
+                pass
+        url = stack_info_url(stack_name, stack_version)
+        text = urllib2.urlopen(url).read()
+        # only keep files in the cache which are known to be valid
+        info = parse_stack_info(text, url)
+        write_cache_file(cache_file, text)
+        return info
+
+
+_loader = None
+
+def get_stack_info_loader():
+    global _loader
+    if _loader is None:
+        _loader = StackInfoLoader()
+    return _loader
+
+
+def load_stack_info(stack_name, stack_version):
+    return get_stack_info_loader().load(stack_name, stack_version)
+
+
+def prefetch_stack_infos(stacks):
+    """
+    :param stacks: list of (stack_name, stack_version)
+    """
+    get_stack_info_loader().prefetch(stacks)
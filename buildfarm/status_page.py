@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import csv
+import json
 import os
 import logging
 import re
@@ -48,6 +49,18 @@ def get_distro_arches(arches, rosdistro):
     distros = buildfarm.rosdistro.get_target_distros(rosdistro)
     return [(d, a) for d in distros for a in arches]
 
+def get_multi_distro_arches(arches, rosdistros):
+    '''
+    Returns the union of the (distro, arch) pairs targeted by several
+    rosdistros, each pair only once.
+    '''
+    distro_arches = []
+    for rosdistro in rosdistros:
+        for distro_arch in get_distro_arches(arches, rosdistro):
+            if distro_arch not in distro_arches:
+                distro_arches.append(distro_arch)
+    return distro_arches
+
 def make_versions_table(ros_pkgs_table, repo_name_da_to_pkgs, da_strs, repo_names, rosdistro):
     '''
     Returns an in-memory table with all the information that will be displayed:
@@ -94,6 +107,8 @@ def add_version_cell(table, pkg_name, repo_name_da_to_pkgs, da_str, repo_names,
         versions.append(v)
     return '|'.join(versions)
 
+_stripped_versions = {}
+
 def strip_version_suffix(version):
     """
     Removes trailing junk from the version number.
@@ -107,8 +122,82 @@ def strip_version_suffix(version):
     >>> strip_version_suffix('1.9.9-foo')
     '1.9.9'
     """
-    match = version_rx.search(version)
-    return match.group(0) if match else version
+    if version not in _stripped_versions:
+        match = version_rx.search(version)
+        _stripped_versions[version] = match.group(0) if match else version
+    return _stripped_versions[version]
+
+
+class DebianVersion(object):
+    """
+    A Debian version string which orders according to the Debian policy
+    (epoch, upstream version, debian revision; '~' sorts before anything).
+
+    >>> DebianVersion('1.9.10-0') > DebianVersion('1.9.9-0')
+    True
+    >>> DebianVersion('1.0~rc1') < DebianVersion('1.0')
+    True
+    >>> DebianVersion('1:0.1') > DebianVersion('2.0')
+    True
+    >>> DebianVersion('1.0-0') == DebianVersion('1.0-00')
+    True
+    """
+
+    def __init__(self, version):
+        self.version = version
+        epoch, upstream, revision = '0', version, '0'
+        if ':' in upstream:
+            epoch, upstream = upstream.split(':', 1)
+        if '-' in upstream:
+            upstream, revision = upstream.rsplit('-', 1)
+        self.key = (int(epoch) if epoch.isdigit() else 0,
+                    _version_part_key(upstream), _version_part_key(revision))
+
+    def __cmp__(self, other):
+        return cmp(self.key, other.key)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return 'DebianVersion(%r)' % self.version
+
+
+_version_part_rx = re.compile(r'([^0-9]*)([0-9]*)')
+
+def _version_part_key(part):
+    """
+    Returns a tuple of alternating non-digit keys and integers which
+    compares like dpkg compares the version part.
+    """
+    key = []
+    for non_digits, digits in _version_part_rx.findall(part):
+        if not non_digits and not digits:
+            continue
+        key.append(tuple(_version_char_order(c) for c in non_digits) + (0,))
+        key.append(int(digits) if digits else 0)
+    # the end of the string sorts after '~' but before anything else
+    key.append((0,))
+    return tuple(key)
+
+def _version_char_order(c):
+    if c == '~':
+        return -1
+    if c.isalpha():
+        return ord(c)
+    return ord(c) + 256
+
+
+_parsed_versions = {}
+
+def get_debian_version(version):
+    """
+    Returns the (cached) DebianVersion for a version string or None for
+    missing versions ('None').
+    """
+    if version not in _parsed_versions:
+        _parsed_versions[version] = DebianVersion(version) if version not in ['None', ''] else None
+    return _parsed_versions[version]
 
 def get_pkg_version(da_str, repo_name_da_to_pkgs, repo_name, name, rosdistro):
     deb_name = buildfarm.rosdistro.debianize_package_name(rosdistro, name)
@@ -146,30 +235,50 @@ def get_dist_arch_str(d, a):
 def get_repo_cache_dir_name(rootdir, ros_repo_name, dist_arch):
     return os.path.join(rootdir, ros_repo_name, dist_arch)
 
-def build_repo_caches(rootdir, ros_repos, distro_arches):
+def get_list_pool_dir(rootdir):
+    return os.path.join(rootdir, 'list-pool')
+
+def build_repo_caches(rootdir, ros_repos, distro_arches, full_update=False):
     '''
     Builds (or rebuilds) local caches for ROS apt repos.
 
+    The caches of all repos for a distro and arch share the lists of the
+    Ubuntu mirror through a pool of hardlinked list files, so these are
+    stored and downloaded only once.
+
     For example, build_repo_caches('/tmp/ros_apt_caches', ros_repos,
                                    get_distro_arches())
     '''
+    pool_dir = get_list_pool_dir(rootdir)
     for repo_name, url in ros_repos.items():
         for distro, arch in distro_arches:
             dist_arch = get_dist_arch_str(distro, arch)
             dir = get_repo_cache_dir_name(rootdir, repo_name, dist_arch)
-            build_repo_cache(dir, repo_name, url, distro, arch)
+            build_repo_cache(dir, repo_name, url, distro, arch, full_update, pool_dir)
+    buildfarm.apt_root.prune_list_pool(pool_dir)
 
-def build_repo_cache(dir, ros_repo_name, ros_repo_url, distro, arch):
+def build_repo_cache(dir, ros_repo_name, ros_repo_url, distro, arch, full_update=False, pool_dir=None):
+    '''
+    Sets up the apt directory and updates its lists.  If the directory is
+    already set up with the same sources only the list of the ROS repo is
+    refreshed, unless full_update is set.  With a pool_dir the lists are
+    shared with the other apt directories using the same pool.
+    '''
     logging.info('Setting up an apt directory at %s', dir)
     repo_dict = {ros_repo_name: ros_repo_url}
-    buildfarm.apt_root.setup_apt_rootdir(dir, distro, arch,
-                                         additional_repos=repo_dict)
+    changed = buildfarm.apt_root.setup_apt_rootdir(dir, distro, arch,
+                                                   additional_repos=repo_dict)
+    if pool_dir:
+        buildfarm.apt_root.seed_lists(dir, pool_dir)
     logging.info('Getting a list of packages for %s-%s', distro, arch)
     cache = apt.Cache(rootdir=dir)
     cache.open()
-    cache.update()
-    # Have to open the cache again after updating.
-    cache.open()
+    if full_update or changed or not buildfarm.apt_root.has_lists(dir):
+        buildfarm.apt_root.update_cache(cache, dir)
+    else:
+        buildfarm.apt_root.update_cache(cache, dir, [ros_repo_name])
+    if pool_dir:
+        buildfarm.apt_root.pool_lists(dir, pool_dir)
 
 def get_wet_names_versions(rosdistro):
     rd = buildfarm.rosdistro.Rosdistro(rosdistro)
@@ -196,23 +305,49 @@ def get_dry_names_packages(rosdistro):
     dry_yaml = yaml.load(urllib2.urlopen(distro_uri(rosdistro)))
     return [(name, d) for name, d in dry_yaml['stacks'].items() if name != '_rules']
 
-def get_pkgs_from_apt_cache(cache_dir, substring):
-    cache = apt.Cache(rootdir=cache_dir)
-    cache.open()
-    return [cache[name] for name in cache.keys() if name.startswith(substring)]
+def get_ros_pkgs_from_apt_caches(rootdir, rosdistros):
+    '''
+    Opens each ROS apt cache only once and partitions its packages by their
+    ros-<rosdistro>- prefix.
 
-def render_csv(rootdir, outfile, rosdistro):
+    Returns {rosdistro: {(repo_name, da_str): [pkg, ...]}}
+    '''
+    arches = bin_arches + ['source']
+    da_strs = get_da_strs(get_multi_distro_arches(arches, rosdistros))
+    repo_da_caches = get_repo_da_caches(rootdir, get_ros_repo_names(ros_repos), da_strs)
+    prefixes = dict(('ros-%s-' % rosdistro, rosdistro) for rosdistro in rosdistros)
+
+    rosdistro_pkgs = dict((rosdistro, {}) for rosdistro in rosdistros)
+    for repo_name, da_str, cache_dir in repo_da_caches:
+        for rosdistro in rosdistros:
+            rosdistro_pkgs[rosdistro][(repo_name, da_str)] = []
+        cache = get_apt_cache(cache_dir)
+        for name in cache.keys():
+            if not name.startswith('ros-'):
+                continue
+            prefix = name[:name.find('-', len('ros-')) + 1]
+            if prefix in prefixes:
+                rosdistro_pkgs[prefixes[prefix]][(repo_name, da_str)].append(cache[name])
+    return rosdistro_pkgs
+
+def render_csv(rootdir, outfile, rosdistro, repo_name_da_to_pkgs=None):
+    '''
+    Writes the versions table of a rosdistro as CSV.  The packages of the ROS
+    apt repos can be passed in (see get_ros_pkgs_from_apt_caches) to share
+    them between several rosdistros, otherwise they are read from rootdir.
+    '''
     arches = bin_arches + ['source']
     da_strs = get_da_strs(get_distro_arches(arches, rosdistro))
-    ros_repo_names = get_ros_repo_names(ros_repos)
-    repo_da_caches = get_repo_da_caches(rootdir, ros_repo_names, da_strs)
     wet_names_versions = get_wet_names_versions(rosdistro)
     dry_names_versions = get_dry_names_versions(rosdistro)
     ros_pkgs_table = get_ros_pkgs_table(wet_names_versions, dry_names_versions)
 
     # Get the version of each Debian package in each ROS apt repository.
-    repo_name_da_to_pkgs = dict(((repo_name, da_str), get_pkgs_from_apt_cache(cache, 'ros-%s-' % rosdistro))
-                                for repo_name, da_str, cache in repo_da_caches)
+    if repo_name_da_to_pkgs is None:
+        repo_name_da_to_pkgs = get_ros_pkgs_from_apt_caches(rootdir, [rosdistro])[rosdistro]
+    repo_name_da_to_pkgs = dict(((repo_name, da_str), pkgs)
+                                for (repo_name, da_str), pkgs in repo_name_da_to_pkgs.items()
+                                if da_str in da_strs)
 
     # Make an in-memory table showing the latest deb version for each package.
     t = make_versions_table(ros_pkgs_table, repo_name_da_to_pkgs, da_strs,
@@ -227,39 +362,169 @@ def render_csv(rootdir, outfile, rosdistro):
             w.writerow(row)
 
 
-def transform_csv_to_html(data_source, metadata_builder, rosdistro, start_time):
-    reader = csv.reader(data_source, delimiter=',', quotechar='"')
-    rows = [row for row in reader]
+def transform_csv_to_html(data_source, metadata_builder, rosdistro, start_time, data_url=None):
+    header, counts, rows, source_columns = transform_csv_to_table(data_source, metadata_builder)
+    return make_status_html(header, counts, rows, rosdistro, start_time, data_url, source_columns)
 
-    header = rows[0]
-    rows = rows[1:]
 
-    # move source columns before amd64/i386 columns for each distro
-    column_mapping = {3: 5, 4: 3, 5: 4, 6: 8, 7: 6, 8: 7, 9: 11, 10: 9, 11: 10}
-    header = [header[column_mapping[i] if column_mapping and i in column_mapping else i] for i in range(len(header))]
-    rows = [[row[column_mapping[i] if column_mapping and i in column_mapping else i] for i in range(len(header))] for row in rows]
+def transform_csv_to_table(data_source, metadata_builder, rosdistro=None, jobgraph=None):
+    '''
+    Returns the formatted header cells, the per (sub-)column counts, the
+    formatted rows and the indices of the source columns for the status
+    table.  If the jobgraph of the rosdistro is given the binary cells are
+    annotated with the missing upstream packages blocking them.
+    '''
+    reader = csv.reader(data_source, delimiter=',', quotechar='"')
+    header = reader.next()
 
-    html_head = make_html_head(rosdistro, start_time)
+    # move source columns before amd64/i386 columns for each distro
+    column_order = get_column_order(header)
+    header = [header[i] for i in column_order]
+    rows = [[row[i] for i in column_order] for row in reader]
+    source_columns = [i for i in range(3, len(header)) if header[i].endswith('_source')]
+
+    # count non-None rows per (sub-)column: split all cells of a column at
+    # once, the versions of each repo are then every len(ros_repos)-th part
+    counts = [[]] * 3
+    columns = zip(*rows) if rows else [()] * len(header)
+    for column in columns[3:]:
+        parts = '|'.join(column).split('|')
+        counts.append([len(column) - parts[j::len(ros_repos)].count('None') for j in range(len(ros_repos))])
+
+    if jobgraph is not None:
+        blockers = compute_blockers(jobgraph, get_missing_packages(header, rows, rosdistro))
+        cell_blockers = [get_cell_blockers(row, header, blockers, rosdistro) for row in rows]
+    else:
+        cell_blockers = [None] * len(rows)
 
     metadata_columns = [None] * 3 + [metadata_builder(c) for c in header[3:]]
     header = [format_header_cell(header[i], metadata_columns[i]) for i in range(len(header))]
 
-    # count non-None rows per (sub-)column
-    counts = [[]] * 3 + [[0] * 3 for _ in range(3, len(header))]
-    for row in rows:
-        for i in range(3, len(counts)):
-            versions = get_cell_versions(row[i])
-            for j in range(0, len(versions)):
-                if versions[j] != 'None':
-                    counts[i][j] += 1
+    rows = [format_row(r, metadata_columns, b, source_columns) for r, b in zip(rows, cell_blockers)]
+    return header, counts, rows, source_columns
 
-    rows = [format_row(r, metadata_columns) for r in rows]
-    body = make_html_legend()
-    body += make_html_table(header, counts, rows)
 
+def get_column_order(header):
+    '''
+    Returns the column indices which group the version columns by distro
+    with the source column before the binary columns of each distro.
+
+    >>> get_column_order(['name', 'version', 'wet', 'precise_amd64', 'precise_source', 'quantal_amd64', 'quantal_i386', 'quantal_source'])
+    [0, 1, 2, 4, 3, 7, 5, 6]
+    '''
+    distros = []
+    for column in header[3:]:
+        distro = column.split('_', 1)[0]
+        if distro not in distros:
+            distros.append(distro)
+    return range(3) + sorted(range(3, len(header)),
+                             key=lambda i: (distros.index(header[i].split('_', 1)[0]), not header[i].endswith('_source'), i))
+
+
+def get_missing_packages(header, rows, rosdistro):
+    '''
+    Returns {da_str: set(debian package names)} of the packages missing in
+    the building repo for each binary column.
+    '''
+    missing = {}
+    for i in range(3, len(header)):
+        if header[i].endswith('source'):
+            continue
+        missing[header[i]] = set([buildfarm.rosdistro.debianize_package_name(rosdistro, row[0])
+                                  for row in rows if get_cell_versions(row[i])[0] == 'None'])
+    return missing
+
+
+def get_dependency_order(jobgraph):
+    '''
+    Returns all packages of the jobgraph (including the dependencies without
+    an entry) with every package after its dependencies.
+
+    >>> get_dependency_order({'c': ['b'], 'b': ['a'], 'd': []})
+    ['a', 'b', 'c', 'd']
+    '''
+    order = []
+    visited = set()
+    for root in sorted(jobgraph.keys()):
+        if root in visited:
+            continue
+        visited.add(root)
+        stack = [(root, iter(jobgraph[root]))]
+        while stack:
+            pkg, deps = stack[-1]
+            for dep in deps:
+                if dep not in visited:
+                    visited.add(dep)
+                    stack.append((dep, iter(jobgraph.get(dep, []))))
+                    break
+            else:
+                stack.pop()
+                order.append(pkg)
+    return order
+
+
+def compute_blockers(jobgraph, missing):
+    '''
+    Returns {(package, column): set(packages)} with the root causes blocking
+    each package in each column.  A root cause is a dependency which is
+    missing itself but has no missing dependencies, reached through missing
+    dependencies only: a present dependency does not pass on its blockers.
+    The blockers are propagated in a single pass over the packages in
+    dependency order.
+
+    >>> jobgraph = {'c': ['b'], 'b': ['a'], 'a': [], 'd': ['b', 'e']}
+    >>> b = compute_blockers(jobgraph, {'col': set(['a', 'b', 'c', 'e'])})
+    >>> sorted(b.items())
+    [(('b', 'col'), set(['a'])), (('c', 'col'), set(['a'])), (('d', 'col'), set(['a', 'e']))]
+    >>> b = compute_blockers({'c': ['b'], 'b': ['a'], 'a': []}, {'col': set(['a', 'c'])})
+    >>> sorted(b.items())
+    [(('b', 'col'), set(['a']))]
+    '''
+    blockers = {}
+    for pkg in get_dependency_order(jobgraph):
+        deps = jobgraph.get(pkg, [])
+        for column, missing_pkgs in missing.iteritems():
+            pkg_blockers = set()
+            for dep in deps:
+                if dep in missing_pkgs:
+                    pkg_blockers |= blockers.get((dep, column)) or set([dep])
+            if pkg_blockers:
+                blockers[(pkg, column)] = pkg_blockers
+    return blockers
+
+
+def get_cell_blockers(row, header, blockers, rosdistro):
+    deb_name = buildfarm.rosdistro.debianize_package_name(rosdistro, row[0])
+    cell_blockers = [None] * len(row)
+    for i in range(3, len(row)):
+        if (deb_name, header[i]) in blockers and get_cell_versions(row[i])[0] == 'None':
+            cell_blockers[i] = sorted([buildfarm.rosdistro.undebianize_package_name(rosdistro, b)
+                                       for b in blockers[(deb_name, header[i])]])
+    return cell_blockers
+
+
+def make_status_html(header, counts, rows, rosdistro, start_time, data_url=None, hidden_columns=None):
+    '''
+    Returns the status page.  If data_url is given the rows are not embedded
+    in the page but loaded by DataTables from that (JSON) url.
+    '''
+    html_head = make_html_head(rosdistro, start_time, data_url, len(header), hidden_columns)
+    body = make_html_legend()
+    body += make_html_table(header, counts, rows if data_url is None else [])
     return make_html_doc(html_head, body)
 
 
+def make_json_data(rows):
+    '''
+    Returns the rows as a compact JSON document in the format expected by
+    the DataTables "sAjaxSource" option.
+
+    >>> make_json_data([['a', '1'], ['b', '2']])
+    '{"aaData":[["a","1"],["b","2"]]}'
+    '''
+    return json.dumps({'aaData': rows}, separators=(',', ':'))
+
+
 def format_header_cell(cell, metadata):
     if metadata and 'column_label' in metadata:
         cell = metadata['column_label']
@@ -268,11 +533,13 @@ def format_header_cell(cell, metadata):
     return cell
 
 
-def format_row(row, metadata_columns):
+def format_row(row, metadata_columns, cell_blockers=None, source_columns=None):
+    if source_columns is None:
+        source_columns = []
     latest_version = row[1]
     public_changing_on_sync = [False] * 3 + [is_public_changing_on_sync(c) for c in row[3:]]
     # as long as the status page is generated on lucid it does not handle source repos correctly which therefore need to be skipped
-    row_without_sources = [c for i, c in enumerate(row) if i > 2 and i % 3]
+    row_without_sources = [c for i, c in enumerate(row) if i > 2 and i not in source_columns]
     has_diff_between_rosdistros = len(set(row_without_sources)) > 1
 
     # urls for each building repository column
@@ -280,17 +547,21 @@ def format_row(row, metadata_columns):
     if row[2] == 'unknown':
         metadata = [None for _ in range(len(metadata))]
     if row[2] == 'False':  # dry
-        metadata[3] = metadata[6] = metadata[9] = None
+        for i in source_columns:
+            metadata[i] = None
     job_urls = [md['job_url'].format(pkg=row[0].replace('_', '-')) if md else None for md in metadata]
 
     type_ = get_wet_column(row)
     # override desired version for unknown (aka variants)
     if type_ not in ['wet', 'dry']:
         latest_version = '1.0.0'
-    row = row[:2] + [type_] + [format_versions_cell(row[i], latest_version, job_urls[i], public_changing_on_sync[i]) for i in range(3, len(row))]
+    if cell_blockers is None:
+        cell_blockers = [None] * len(row)
+    row = row[:2] + [type_] + [format_versions_cell(row[i], latest_version, job_urls[i], public_changing_on_sync[i], cell_blockers[i]) for i in range(3, len(row))]
     if has_diff_between_rosdistros:
         row[0] += ' <span class="hiddentext">diff</span>'
-    row[3] = row[6] = row[9] = ''
+    for i in source_columns:
+        row[i] = ''
 
     return row
 
@@ -312,11 +583,11 @@ def get_wet_column(row):
     return value
 
 
-def format_versions_cell(cell, latest_version, url=None, public_changing_on_sync=False):
+def format_versions_cell(cell, latest_version, url=None, public_changing_on_sync=False, blockers=None):
     versions = get_cell_versions(cell)
     repos = ['building', 'shadow-fixed', 'ros/public']
     search_suffixes = ['1', '2', '3']
-    cell = ''.join([format_version(v, latest_version, r, s, versions[-1], url if r == 'building' else None) for v, r, s in zip(versions, repos, search_suffixes)])
+    cell = ''.join([format_version(v, latest_version, r, s, versions[-1], url if r == 'building' else None, blockers if r == 'building' else None) for v, r, s in zip(versions, repos, search_suffixes)])
 
     if public_changing_on_sync:
         cell += '<span class="hiddentext">sync</span>'
@@ -324,8 +595,10 @@ def format_versions_cell(cell, latest_version, url=None, public_changing_on_sync
     return cell
 
 
-def format_version(version, latest, repo, search_suffix, public_version, url=None):
+def format_version(version, latest, repo, search_suffix, public_version, url=None, blockers=None):
     label = '%s: %s' % (repo, version)
+    if blockers:
+        label += ' (blocked by %s)' % ', '.join(blockers)
     if latest:
         color = {'None': 'pkgMissing', latest: 'pkgLatest'}.get(version, 'pkgOutdated')
         # use reasonable names (even if invisible) to be searchable
@@ -337,22 +610,58 @@ def format_version(version, latest, repo, search_suffix, public_version, url=Non
     order_value += search_suffix
     if repo != 'ros/public' and is_regression(version, public_version):
         order_value += '&nbsp;regression' + search_suffix
+    if blockers:
+        order_value += '&nbsp;blocked' + search_suffix
     if url:
         order_value = '<a href="%s">%s</a>' % (url, order_value)
     return make_square_div(label, color, order_value)
 
 
 def is_regression(version, public_version):
-    # public has a package and specific repo doesn't
-    return public_version != 'None' and version == 'None'
+    """
+    Returns True if the repo is missing a package or has an older version
+    than public.
+
+    >>> is_regression('None', '1.0.0-0')
+    True
+    >>> is_regression('1.0.9-0', '1.0.10-0')
+    True
+    >>> is_regression('1.0.10-0', '1.0.9-0')
+    False
+    >>> is_regression('None', 'None')
+    False
+    """
+    public_version = get_debian_version(public_version)
+    if public_version is None:
+        return False
+    version = get_debian_version(version)
+    return version is None or version < public_version
 
 
 def make_square_div(label, color, order_value):
     return '<div class="square %s" title="%s">%s</div>' % (color, label, order_value)
 
 
-def make_html_head(rosdistro, start_time):
+def make_html_head(rosdistro, start_time, data_url=None, num_columns=12, hidden_columns=None):
+    if hidden_columns is None:
+        hidden_columns = []
     rosdistro = rosdistro[0].upper() + rosdistro[1:]
+    if data_url is None:
+        data_options = '''
+            "bPaginate": false,'''
+    else:
+        # only create the DOM nodes for the rows which are actually displayed
+        data_options = '''
+            "sAjaxSource": "%s",
+            "bDeferRender": true,
+            "bPaginate": true,
+            "sPaginationType": "full_numbers",
+            "iDisplayLength": 100,
+            "aLengthMenu": [[100, 500, 1000, -1], [100, 500, 1000, "All"]],''' % data_url
+    column_filters = ['{ type: "text" }', '{ type: "text" }', '{ type: "select",  values: [\'wet\', \'dry\', \'unknown\'] }']
+    column_filters += ['{ type: "text" }'] * (num_columns - len(column_filters))
+    column_filters = ',\n                '.join(column_filters)
+    hide_columns = '\n        '.join(['oTable.fnSetColumnVis(%d, false);' % i for i in hidden_columns])
     # Some of the code here is taken from a datatables example.
     return '''
 <title>ROS %s - build status page - %s</title>
@@ -430,8 +739,7 @@ def make_html_head(rosdistro, start_time):
 
     $(document).ready(function() {
         var oTable = $('#csv_table').dataTable( {
-            "bJQueryUI": true,
-            "bPaginate": false,
+            "bJQueryUI": true,%s
             "bStateSave": true,
             "iCookieDuration": 60*60*24*7,
             "sDom": 'T<"clear">lfrtip',
@@ -440,29 +748,16 @@ def make_html_head(rosdistro, start_time):
                 "sRowSelect": "multi"
             },
             "oLanguage": {
-                "sSearch": '<span id="search" title="Special keywords to search for: diff, sync, regression, green, blue, red, yellow, gray">Search:</span>'
+                "sSearch": '<span id="search" title="Special keywords to search for: diff, sync, regression, blocked, green, blue, red, yellow, gray">Search:</span>'
             }
         } );
         oTable.columnFilter( {
             "aoColumns": [
-                { type: "text" },
-                { type: "text" },
-                { type: "select",  values: ['wet', 'dry', 'unknown'] },
-                { type: "text" },
-                { type: "text" },
-                { type: "text" },
-                { type: "text" },
-                { type: "text" },
-                { type: "text" },
-                { type: "text" },
-                { type: "text" },
-                { type: "text" }
+                %s
             ],
             "bUseColVis": true
         } );
-        oTable.fnSetColumnVis(3, false);
-        oTable.fnSetColumnVis(6, false);
-        oTable.fnSetColumnVis(9, false);
+        %s
 
         new FixedHeader(oTable);
 
@@ -491,7 +786,7 @@ def make_html_head(rosdistro, start_time):
     } );
     /* ]]> */
 </script>
-''' % (rosdistro, time.strftime('%Y-%m-%d %H:%M:%S %Z', start_time))
+''' % (rosdistro, time.strftime('%Y-%m-%d %H:%M:%S %Z', start_time), data_options, column_filters, hide_columns)
 
 
 def make_html_legend():
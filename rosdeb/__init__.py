@@ -33,6 +33,6 @@
 # Revision $Id: __init__.py 14995 2011-09-15 23:50:03Z kwc $
 
 from rosdeb.core import debianize_name, debianize_version
-from rosdeb.source_deb import make_source_deb, control_file
+from rosdeb.source_deb import make_source_deb, make_source_debs, control_file
 from rosdeb.repo import get_Packages, get_depends, deb_in_repo, BadRepo
 
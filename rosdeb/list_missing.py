@@ -50,7 +50,9 @@ import time
 import rospkg.distro
 
 from core import debianize_name, debianize_version
-from repo import deb_in_repo, load_Packages, get_repo_version, get_stack_version, BadRepo
+from repo import deb_in_repo, deb_in_index, get_Packages_index, load_Packages, get_repo_version, get_stack_version, BadRepo
+from buildfarm.stack_info import load_stack_info, prefetch_stack_infos
+from buildfarm.cache_file import write_cache_file
 
 NAME = 'list_missing.py' 
 TARBALL_URL = "https://code.ros.org/svn/release/download/stacks/%(stack_name)s/%(base_name)s/%(f_name)s"
@@ -66,7 +68,6 @@ ARCHES = ['i386', 'amd64'] #,'armel'
 
 import traceback
 
-_distro_yaml_cache = {}
 
 def svn_url_exists(url):
     """
@@ -85,11 +86,7 @@ def load_info(stack_name, stack_version):
     url = TARBALL_URL%locals()
 
     try:
-        if url in _distro_yaml_cache:
-            return _distro_yaml_cache[url]
-        else:
-            _distro_yaml_cache[url] = l = yaml.load(urllib2.urlopen(url))
-            return l
+        return load_stack_info(stack_name, stack_version)
     except:
         raise Exception("Problem fetching yaml info for %s %s (%s)"%(stack_name, stack_version, url))
 
@@ -131,6 +128,7 @@ def compute_deps(distro, stack_name, ignore_catkinized = True):
         ordered_deps.append((s,v))
 
     if stack_name == 'ALL':
+        prefetch_stack_infos([(s, distro.stacks[s].version) for s in distro.released_stacks.keys()])
         for s in distro.released_stacks.keys():
             add_stack(s)
     else:
@@ -142,90 +140,250 @@ def compute_deps(distro, stack_name, ignore_catkinized = True):
     return ordered_deps
 
 
+EXCLUDES_URI = "https://code.ros.org/svn/release/trunk/distros/%s.excludes"
+EXCLUDES_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'excludes-cache')
+EXCLUDES_CACHE_TTL = 3600
+
 class ExclusionList(object):
-    def __init__(self, uri, distro_name, os_platform, arch):
-        try:
-            self.excludes = yaml.load(urllib2.urlopen(uri).read()) or {}
-        except urllib2.HTTPError:
-            self.excludes = {}
-        self.key = "%s-%s"%(os_platform,arch)
+    """
+    Stacks excluded from being built per platform and arch. The
+    excludes file is cached on disk and only downloaded again after
+    ttl seconds.
+    """
 
-    def check(self, stack):
-        return stack in self.excludes and self.key in self.excludes[stack]
+    def __init__(self, uri, distro_name, cache_dir=EXCLUDES_CACHE_DIR, ttl=EXCLUDES_CACHE_TTL):
+        cache_file = os.path.join(cache_dir, "%s.excludes"%(distro_name))
+        excludes = yaml.load(self._load(uri, cache_file, ttl)) or {}
+        self.excluded = set([(stack, key) for stack, keys in excludes.iteritems() for key in (keys or [])])
+
+    def _load(self, uri, cache_file, ttl):
+        if os.path.exists(cache_file) and time.time() - os.path.getmtime(cache_file) < ttl:
+            with open(cache_file) as f:
+                return f.read()
+        try:
+            text = urllib2.urlopen(uri).read()
+        except urllib2.URLError as e:
+            # a missing file means that nothing is excluded
+            if isinstance(e, urllib2.HTTPError) and e.code == 404:
+                return ''
+            # fall back to an outdated copy when the server is not reachable
+            # or fails to serve the file
+            if os.path.exists(cache_file):
+                with open(cache_file) as f:
+                    return f.read()
+            raise
+        write_cache_file(cache_file, text)
+        return text
+
+    def check(self, stack, os_platform, arch):
+        return (stack, "%s-%s"%(os_platform, arch)) in self.excluded
+
+_exclusion_lists = {}
+def get_exclusion_list(distro_name):
+    """
+    @return: the L{ExclusionList} of the distro, loaded only once
+    """
+    if distro_name not in _exclusion_lists:
+        _exclusion_lists[distro_name] = ExclusionList(EXCLUDES_URI%(distro_name), distro_name)
+    return _exclusion_lists[distro_name]
 
 
 def compute_missing_depends(stack_name, distro, os_platform, arch, repo=SHADOW_REPO, lock_version=True):
-    missing_deps = set()
-    deps = compute_deps(distro, stack_name, ignore_catkinized = False)
-    #don't include self
-    deps = set([(sn, sv) for (sn, sv) in deps if not sn == stack_name])
-    for sn, sv in deps:
-        deb_name = "ros-%s-%s"%(distro.release_name, debianize_name(sn))
-        # see if there's a dry version
-        deb_version = '[0-9.-]*-[st][0-9]+~[a-z]+' 
-        if not deb_in_repo(repo, deb_name, deb_version, os_platform, arch, use_regex=True):
-            # now test for wet version
-            wet_deb_version = '[0-9.]*-[0-9a-z]+-[0-9]+-[0-9]+-\+0000'
-            if not deb_in_repo(repo, deb_name, wet_deb_version, os_platform, arch, use_regex=True):
-                missing_deps.add(deb_name)
+    return compute_missing_depends_batch([stack_name], distro, os_platform, arch, repo)[stack_name]
 
+def compute_missing_depends_batch(stack_names, distro, os_platform, arch, repo=SHADOW_REPO):
+    """
+    Compute the missing dependencies of several stacks at once. The
+    dependency closures share their common parts and the repo is only
+    read once for all stacks.
+    @return: {stack_name: set of missing debian package names}
+    """
+    # a dependency is present if either a dry or a wet version of it is in the repo
+    deb_version = '([0-9.-]*-[st][0-9]+~[a-z]+|[0-9.]*-[0-9a-z]+-[0-9]+-[0-9]+-\+0000)'
+    packages_index = get_Packages_index(repo, os_platform, arch)
+    prefix = "ros-%s-"%(distro.release_name)
+    present = set([deb_name for deb_name in packages_index if deb_name.startswith(prefix) and deb_in_index(packages_index, deb_name, deb_version)])
+
+    # {stack: (stacks, ignored)} with the direct dependencies of the stack
+    # in the distro and the ones which are not, None if it can't be loaded
+    depends = {}
+    def get_depends(s):
+        if s not in depends:
+            try:
+                si = load_info(s, distro.stacks[s].version)
+            except Exception as e:
+                sys.stderr.write(str(e) + '\n')
+                depends[s] = None
+                return None
+            depends[s] = (set([d for d in si['depends'] if d in distro.stacks]),
+                          set([d for d in si['depends'] if d not in distro.stacks]))
+        return depends[s]
+
+    # {stack: (stacks, ignored)} with the dependency closure of the stack
+    # (including itself) and the dependencies which are not in the distro.
+    # The closures are computed per strongly connected component (Tarjan)
+    # since all stacks of a dependency cycle share the same closure.
+    closures = {}
+    index = {}
+    lowlink = {}
+    component_stack = []
+    def visit(s):
+        index[s] = lowlink[s] = len(index)
+        component_stack.append(s)
+        deps = get_depends(s)
+        for d in (deps[0] if deps else []):
+            if d not in index:
+                visit(d)
+                lowlink[s] = min(lowlink[s], lowlink[d])
+            elif d not in closures:
+                # d is still on the component stack
+                lowlink[s] = min(lowlink[s], index[d])
+        if lowlink[s] == index[s]:
+            component = component_stack[component_stack.index(s):]
+            del component_stack[component_stack.index(s):]
+            stacks, ignored = set(), set()
+            for c in component:
+                if depends[c] is None:
+                    continue
+                stacks.add(c)
+                ignored |= depends[c][1]
+                for d in depends[c][0]:
+                    if d in closures:
+                        stacks |= closures[d][0]
+                        ignored |= closures[d][1]
+            for c in component:
+                closures[c] = (stacks, ignored)
+
+    missing_deps = {}
+    for stack_name in stack_names:
+        if stack_name not in distro.stacks:
+            raise MissingDefinition("[%s] not found in distro."%(stack_name))
+        if stack_name not in index:
+            visit(stack_name)
+        stacks, ignored = closures[stack_name]
+        deb_names = set(["%s%s"%(prefix, debianize_name(sn)) for sn in (stacks | ignored) if sn != stack_name])
+        missing_deps[stack_name] = deb_names - present
     return missing_deps
 
 def get_missing(distro, os_platform, arch, repo=SHADOW_REPO, lock_version=True):
+    target = (repo, os_platform, arch, lock_version)
+    missing = get_missing_targets(distro, [target])[target]
+    if missing is None:
+        raise BadRepo(repo)
+    return missing
+
+def propagate_missing(missing, get_depends, excluded=set()):
+    """
+    Classify missing stacks by propagating their state along the
+    dependency graph. A missing stack is MISSING_EXCLUDED if it is
+    excluded, MISSING_PRIMARY if none of its dependencies is missing,
+    MISSING_EXCLUDED_DEP if it depends on an excluded stack (directly or
+    indirectly) and MISSING_DEP otherwise.
+    @param missing: set of missing stack names
+    @param get_depends: function returning the dependencies of a missing stack
+    @param excluded: set of missing stacks which are excluded
+    @return: {stack: (state, path)} for each missing stack, where path
+      lists the stacks from the stack down to the one blocking it
+    """
+    result = {}
+    visiting = set()
+
+    def visit(sn):
+        if sn in result:
+            return result[sn]
+        if sn in excluded:
+            result[sn] = (MISSING_EXCLUDED, [sn])
+            return result[sn]
+        visiting.add(sn)
+        blocker = None
+        # dependency cycles are broken by ignoring stacks which are still being visited
+        for d in sorted(get_depends(sn)):
+            if d not in missing or d in visiting:
+                continue
+            state, path = visit(d)
+            if blocker is None or state in (MISSING_EXCLUDED, MISSING_EXCLUDED_DEP):
+                blocker = (state, path)
+                if state in (MISSING_EXCLUDED, MISSING_EXCLUDED_DEP):
+                    break
+        visiting.remove(sn)
+        if blocker is None:
+            result[sn] = (MISSING_PRIMARY, [sn])
+        elif blocker[0] in (MISSING_EXCLUDED, MISSING_EXCLUDED_DEP):
+            result[sn] = (MISSING_EXCLUDED_DEP, [sn] + blocker[1])
+        else:
+            result[sn] = (MISSING_DEP, [sn] + blocker[1])
+        return result[sn]
+
+    for sn in missing:
+        visit(sn)
+    return result
+
+def get_missing_targets(distro, targets):
+    """
+    Compute the missing stacks for several targets at once. The
+    dependency order of the distro and the stack dependencies are
+    computed once and each repo is only loaded once for all targets.
+    @param targets: list of (repo, os_platform, arch, lock_version)
+    @return: {target: (missing_primary, missing_dep, missing_excluded,
+      missing_excluded_dep)}, None for targets whose repo does not exist
+    """
     distro_name = distro.release_name
     # Load the list of exclusions
-    excludes_uri = "https://code.ros.org/svn/release/trunk/distros/%s.excludes"%(distro_name)
-    excludes = ExclusionList(excludes_uri, distro_name, os_platform, arch)
+    excludes = get_exclusion_list(distro_name)
 
     # Find all the deps in the distro for this stack
     deps = compute_deps(distro, 'ALL')
 
     # These stacks are not actually relased, so we treat them as implicitly excluded
-    missing_primary = set(distro.stacks.keys()) - set(distro.released_stacks.keys())
-    missing_dep = set()
-    missing_excluded = set(distro.stacks.keys()) - set(distro.released_stacks.keys())
-    missing_excluded_dep = set()
-
-    # Build the deps in order
-    for (sn, sv) in deps:
-        if not sv:
-            missing_primary.add(sn)
-            continue
-        deb_name = "ros-%s-%s"%(distro_name, debianize_name(sn))
-        if lock_version:
-            deb_version = debianize_version(sv, '\w*', os_platform)
-        else:
-            deb_version = '[0-9.]*-[st][0-9]+~[a-z]+'
-        if not deb_in_repo(repo, deb_name, deb_version, os_platform, arch, use_regex=True):
-            try:
-                si = load_info(sn, sv)
-                depends = set(si['depends'])
-            except:
-                # stack is missing, including its info
-                depends = set()
+    unreleased = set(distro.stacks.keys()) - set(distro.released_stacks.keys())
 
+    results = {}
+    indexes = {}
+    for target in targets:
+        repo, os_platform, arch, lock_version = target
+        try:
+            indexes[target] = get_Packages_index(repo, os_platform, arch)
+        except BadRepo:
+            results[target] = None
+
+    stack_depends = {}
+    def get_depends(sn):
+        if sn not in stack_depends:
+            sv = distro.stacks[sn].version
+            depends = set()
+            if sv:
+                try:
+                    depends = set(load_info(sn, sv)['depends'])
+                except:
+                    # stack is missing, including its info
+                    pass
             # subtract any depends that aren't in the distro b/c of catkin dry/wet line
-            to_remove = [d for d in depends if not d in distro.stacks]
-            for d in to_remove:
-                depends.remove(d)
-                
-            if excludes.check(sn):
-                missing_excluded.add(sn)
-                missing_primary.add(sn)
-            elif depends.isdisjoint(missing_primary.union(missing_dep)):
-                missing_primary.add(sn)
-            else:
-                missing_dep.add(sn)
-                if not depends.isdisjoint(missing_excluded.union(missing_excluded_dep)):
-                    missing_excluded_dep.add(sn)
+            stack_depends[sn] = set([d for d in depends if d in distro.stacks])
+        return stack_depends[sn]
+
+    for target, index in indexes.iteritems():
+        repo, os_platform, arch, lock_version = target
+        missing = set(unreleased)
+        excluded = set(unreleased)
+        for (sn, sv) in deps:
+            if sv:
+                if lock_version:
+                    deb_version = debianize_version(sv, '\w*', os_platform)
+                else:
+                    deb_version = '[0-9.]*-[st][0-9]+~[a-z]+'
+                if deb_in_index(index, "ros-%s-%s"%(distro_name, debianize_name(sn)), deb_version):
+                    continue
+                if excludes.check(sn, os_platform, arch):
+                    excluded.add(sn)
+            missing.add(sn)
 
-        else:
-            pass
-            #print "IN", sn
-    missing_primary -= missing_excluded
-    missing_dep -= missing_excluded_dep
+        # missing_primary, missing_dep, missing_excluded, missing_excluded_dep
+        results[target] = (set(), set(), set(), set())
+        states = [MISSING_PRIMARY, MISSING_DEP, MISSING_EXCLUDED, MISSING_EXCLUDED_DEP]
+        for sn, (state, _) in propagate_missing(missing, get_depends, excluded).iteritems():
+            results[target][states.index(state)].add(sn)
 
-    return missing_primary, missing_dep, missing_excluded, missing_excluded_dep
+    return results
 
 def list_missing(distro, os_platform, arch):
     distro_name = distro.release_name
@@ -415,29 +573,31 @@ def generate_allhtml_report(output, distro_name, os_platforms):
             except:
                 fixed_repo["%s-%s"%(os_platform, arch)] = []
 
-    missing_primary = None
-    missing_dep = None
-
     counts = {}
     stacks = {}
     for stack in distro.stacks.keys():
         stacks[stack] = {}
 
+    # the sourcedeb of a stack is checked only once per platform
+    sourcedebs = {}
+    def sourcedeb_exists(s, os_platform):
+        if (s, os_platform) not in sourcedebs:
+            sourcedebs[(s, os_platform)] = svn_url_exists(sourcedeb_url(distro, s, os_platform))
+        return sourcedebs[(s, os_platform)]
+
+    targets = []
+    for os_platform in os_platforms:
+        for arch in arches:
+            targets.append((SHADOW_REPO, os_platform, arch, True))
+            targets.append((SHADOW_FIXED_REPO, os_platform, arch, False))
+    missing = get_missing_targets(distro, targets)
+
     for os_platform in os_platforms:
         for arch in arches:
             key = "%s-%s"%(os_platform, arch)
-            try:
-                missing_primary, missing_dep, missing_excluded, missing_excluded_dep = get_missing(distro, os_platform, arch)
-            except BadRepo:
-                for s in distro.stacks.iterkeys():
-                    stacks[s][key] = MISSING_REPO
-                counts[key] = "!"
-                continue
-            
-            args = get_missing(distro, os_platform, arch)
-            try:
-                args_fixed = get_missing(distro, os_platform, arch, repo=SHADOW_FIXED_REPO, lock_version=False)
-            except BadRepo:
+            args = missing[(SHADOW_REPO, os_platform, arch, True)]
+            args_fixed = missing[(SHADOW_FIXED_REPO, os_platform, arch, False)]
+            if args is None or args_fixed is None:
                 for s in distro.stacks.iterkeys():
                     stacks[s][key] = MISSING_REPO
                 counts[key] = "!"
@@ -446,22 +606,22 @@ def generate_allhtml_report(output, distro_name, os_platforms):
             missing_primary, missing_dep, missing_excluded, missing_excluded_dep = args
             missing_primary_fixed, missing_dep_fixed, missing_excluded_fixed, missing_excluded_dep_fixed = args_fixed
             for s in missing_primary:
-                if svn_url_exists(sourcedeb_url(distro, s, os_platform)):
+                if sourcedeb_exists(s, os_platform):
                     stacks[s][key] = MISSING_PRIMARY
                 else:
                     stacks[s][key] = MISSING_SOURCEDEB
             for s in missing_dep:
-                if svn_url_exists(sourcedeb_url(distro, s, os_platform)):
+                if sourcedeb_exists(s, os_platform):
                     stacks[s][key] = MISSING_DEP
                 else:
                     stacks[s][key] = MISSING_SOURCEDEB
             for s in missing_primary_fixed:
-                if svn_url_exists(sourcedeb_url(distro, s, os_platform)):
+                if sourcedeb_exists(s, os_platform):
                     stacks[s][key] = MISSING_BROKEN
                 else:
                     stacks[s][key] = MISSING_SOURCEDEB
             for s in missing_dep_fixed:
-                if svn_url_exists(sourcedeb_url(distro, s, os_platform)):
+                if sourcedeb_exists(s, os_platform):
                     stacks[s][key] = MISSING_BROKEN_DEP
                 else:
                     stacks[s][key] = MISSING_SOURCEDEB
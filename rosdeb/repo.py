@@ -111,6 +111,40 @@ def deb_in_repo(repo_url, deb_name, deb_version, os_platform, arch, use_regex=Tr
         M = re.search('^Package: %s\nVersion: %s$'%(deb_name, deb_version), packagelist, re.MULTILINE)
         return M is not None
 
+_Packages_index_cache = {}
+def get_Packages_index(repo_url, os_platform, arch, cache=None):
+    """
+    Retrieve the package list from the repo as a dictionary mapping
+    each package name to its versions. The parsed index is cached
+    like the package list itself.
+    @raise BadRepo: if repo does not exist
+    """
+    if cache is None:
+        cache = _Packages_index_cache
+    key = (repo_url, os_platform, arch)
+    if key not in cache:
+        index = {}
+        package = None
+        for l in get_Packages(repo_url, os_platform, arch).split('\n'):
+            if l.startswith('Package: '):
+                package = l[len('Package: '):]
+            elif l.startswith('Version: ') and package is not None:
+                index.setdefault(package, []).append(l[len('Version: '):])
+                package = None
+        cache[key] = index
+    return cache[key]
+
+def deb_in_index(index, deb_name, deb_version):
+    """
+    @param index: package index as returned by get_Packages_index
+    @param deb_version: regular expression the whole version has to match
+    """
+    versions = index.get(deb_name)
+    if not versions:
+        return False
+    version_re = re.compile('%s$'%(deb_version))
+    return any(version_re.match(v) for v in versions)
+
 def get_depends(repo_url, deb_name, os_platform, arch):
     """
     Get all debian package dependencies by scraping the Packages
@@ -6,13 +6,15 @@ usage: %prog [args]
 
 import os, sys, string
 from optparse import OptionParser
-import subprocess
+from relocate import find_files, relocate
 
 def main(argv, stdout, environ):
 
   parser = OptionParser(__doc__.strip())
   parser.add_option("-t","--test",action="store_true", dest="test",default=False,
                     help="A testing flag")
+  parser.add_option("-j","--jobs",action="store",type="int", dest="jobs",default=None,
+                    help="Number of files to process in parallel")
 #  parser.add_option("-v","--var",action="store",type="string", dest="var",default="blah")
 
   (options, args) = parser.parse_args()
@@ -34,13 +36,9 @@ def main(argv, stdout, environ):
   print 'Replacing: %s'%(old_str)
   print '     with: %s'%(new_str_pad)
 
-  with open(path, 'r') as f:
-    binstr = f.read()
-
-  binstr = binstr.replace(old_str,new_str_pad)
-
-  with open(path, 'w') as f:
-    f.write(binstr)
+  files = find_files(path)
+  count = relocate(files, old_str, new_str_pad, options.jobs)
+  print 'Relocated %d of %d files'%(count, len(files))
 
 
 if __name__ == "__main__":
@@ -6,13 +6,15 @@ usage: %prog [args]
 
 import os, sys, string
 from optparse import OptionParser
-import subprocess
+from relocate import find_files, relocate
 
 def main(argv, stdout, environ):
 
   parser = OptionParser(__doc__.strip())
   parser.add_option("-t","--test",action="store_true", dest="test",default=False,
                     help="A testing flag")
+  parser.add_option("-j","--jobs",action="store",type="int", dest="jobs",default=None,
+                    help="Number of files to process in parallel")
 
   (options, args) = parser.parse_args()
 
@@ -31,19 +33,9 @@ def main(argv, stdout, environ):
   print 'Replacing: %s'%old_path
   print '     with: %s'%new_path
 
-  for root, dirs, files in os.walk(path):
-    for f in files:
-
-      if f[-3:] == '.pc':
-
-        with open(os.path.join(root,f), 'r') as ff:
-          pcstr = ff.read()
-
-        pcstr = pcstr.replace(old_path,new_path)
-
-        with open(os.path.join(root,f), 'w') as ff:
-          ff.write(pcstr)
-        
+  files = find_files(path, '.pc')
+  count = relocate(files, old_path, new_path, options.jobs)
+  print 'Relocated %d of %d .pc files'%(count, len(files))
 
 
 if __name__ == "__main__":
@@ -6,13 +6,91 @@ usage: %prog [args]
 
 import os, sys, string
 from optparse import OptionParser
-import subprocess
+import mmap
+import struct
+from relocate import find_files, process_files
+
+ELF_MAGIC = '\x7fELF'
+SHT_DYNAMIC = 6
+DT_NULL = 0
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+def read_rpaths(m):
+  """
+  Find the DT_RPATH and DT_RUNPATH entries of a mapped ELF file.
+  @return: list of (offset, rpath) with the file offset of each rpath string
+  """
+  if m[4] == '\x01':
+    # 32 bit
+    ehdr, shdr, dyn = 'HHIIIIIHHHHHH', 'IIIIIIIIII', 'iI'
+  elif m[4] == '\x02':
+    ehdr, shdr, dyn = 'HHIQQQIHHHHHH', 'IIQQQQIIQQ', 'qQ'
+  else:
+    return []
+  endian = '<' if m[5] == '\x01' else '>'
+  ehdr, shdr, dyn = [struct.Struct(endian + s) for s in (ehdr, shdr, dyn)]
+
+  e = ehdr.unpack_from(m, 16)
+  shoff, shentsize, shnum = e[5], e[10], e[11]
+  sections = [shdr.unpack_from(m, shoff + i * shentsize) for i in range(shnum)]
+
+  rpaths = []
+  for sh_type, sh_offset, sh_size, sh_link in [(s[1], s[4], s[5], s[6]) for s in sections]:
+    if sh_type != SHT_DYNAMIC:
+      continue
+    strtab_offset = sections[sh_link][4]
+    for i in range(sh_size // dyn.size):
+      d_tag, d_val = dyn.unpack_from(m, sh_offset + i * dyn.size)
+      if d_tag == DT_NULL:
+        break
+      if d_tag in (DT_RPATH, DT_RUNPATH):
+        start = strtab_offset + d_val
+        rpaths.append((start, m[start:m.find('\0', start)]))
+  return rpaths
+
+def fix_rpath(args):
+  """
+  Replace old_rpath with new_rpath in the rpaths of a file, in place.
+  The file is only opened for writing if one of its rpaths matches.
+  @return: list of (old, new) rpaths which have been changed
+  """
+  path, old_rpath, new_rpath = args
+  with open(path, 'rb') as f:
+    if f.read(4) != ELF_MAGIC:
+      return []
+    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      matches = [(offset, rp) for offset, rp in read_rpaths(m) if old_rpath in rp]
+    except (struct.error, IndexError):
+      # not a valid ELF file
+      matches = []
+    finally:
+      m.close()
+  if not matches:
+    return []
+
+  changed = []
+  with open(path, 'r+b') as f:
+    m = mmap.mmap(f.fileno(), 0)
+    try:
+      for offset, rp in matches:
+        newrp = rp.replace(old_rpath, new_rpath)
+        # the new string is never longer, pad the rest of the old one
+        m[offset:offset + len(rp)] = newrp + '\0' * (len(rp) - len(newrp))
+        changed.append((rp, newrp))
+      m.flush()
+    finally:
+      m.close()
+  return changed
 
 def main(argv, stdout, environ):
 
   parser = OptionParser(__doc__.strip())
   parser.add_option("-t","--test",action="store_true", dest="test",default=False,
                     help="A testing flag")
+  parser.add_option("-j","--jobs",action="store",type="int", dest="jobs",default=None,
+                    help="Number of files to process in parallel")
 
   (options, args) = parser.parse_args()
 
@@ -31,21 +109,12 @@ def main(argv, stdout, environ):
   print 'Replacing: %s'%old_rpath
   print '     with: %s'%new_rpath
 
-  for root, dirs, files in os.walk(path):
-    for f in files:
-
-      r = subprocess.Popen(['chrpath', os.path.join(root,f)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-      (o,e) = r.communicate()
-
-      if (r.returncode == 0):
-
-        rp = o.split('RPATH=')[1].strip()
-
-        if old_rpath in rp:
-          newrp = rp.replace(old_rpath, new_rpath)
-          subprocess.check_call(['chrpath', os.path.join(root,f), '-r', newrp])
-      
-  
+  files = find_files(path)
+  changed = process_files(fix_rpath, [(f, old_rpath, new_rpath) for f in files], options.jobs)
+  for f, c in zip(files, changed):
+    for rp, newrp in c:
+      print '%s: RPATH=%s => %s'%(f, rp, newrp)
+  print 'Relocated %d of %d files'%(len([c for c in changed if c]), len(files))
 
 
 if __name__ == "__main__":
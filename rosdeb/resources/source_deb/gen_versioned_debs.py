@@ -19,6 +19,23 @@ except ImportError:
   import roslib.rospack
   depends_1 = roslib.rospack.rosstack_depends_1
   
+def get_installed_versions(debnames):
+  """
+  Look up the versions of several installed debs with a single dpkg-query call.
+  @return: dict mapping each installed deb to its version
+  """
+  if not debnames:
+    return {}
+  # dpkg-query fails if any of the debs is unknown but still lists the others
+  cmd = subprocess.Popen(['dpkg-query', '-W', '-f', '${Package}\t${Version}\n'] + debnames, stdout=subprocess.PIPE)
+  o,e = cmd.communicate()
+  versions = {}
+  for l in o.splitlines():
+    name, version = l.split('\t')
+    if version:
+      versions[name] = version.strip()
+  return versions
+
 def main(argv, stdout, environ):
 
   parser = OptionParser(__doc__.strip())
@@ -30,22 +47,15 @@ def main(argv, stdout, environ):
     
   distro,stack = args
 
+  debnames = ["ros-%s-%s"%(distro, stk.replace('_','-')) for stk in depends_1(stack)]
+  versions = get_installed_versions(debnames)
+
   deps = []
-  
-  for stk in depends_1(stack):
-    version = None
-    debname = "ros-%s-%s"%(distro, stk.replace('_','-'))
-    cmd = subprocess.Popen(['dpkg', '-s', debname], stdout=subprocess.PIPE)
-    o,e = cmd.communicate()
-    if cmd.returncode != 0:
-      raise "Could not find dependency version number"
-    for l in o.splitlines():
-      if l.startswith('Version:'):
-        version = l.split()[1].strip()
-    if version:
-      deps.append("%s (= %s)"%(debname,version))
-    else:
-      raise "Could not find dependency version number"
+  for debname in debnames:
+    if not versions.get(debname):
+      print >> sys.stderr, "Could not find dependency version number of %s"%debname
+      sys.exit(1)
+    deps.append("%s (= %s)"%(debname,versions[debname]))
 
   print "rosstack:Depends="+", ".join(deps)
 
@@ -0,0 +1,86 @@
+"""
+Helpers shared by the scripts relocating an installed stack from its
+build prefix to its final prefix.
+"""
+
+import os
+import mmap
+import multiprocessing
+
+def find_files(path, suffix=''):
+  """
+  @return: list of the regular files below path ending with suffix,
+    or path itself if it is a file
+  """
+  if os.path.isfile(path):
+    return [path]
+  files = []
+  for root, dirs, fs in os.walk(path):
+    for f in fs:
+      p = os.path.join(root, f)
+      if f.endswith(suffix) and os.path.isfile(p) and not os.path.islink(p):
+        files.append(p)
+  return files
+
+def process_files(func, args, jobs=None):
+  """
+  Apply func to every element of args in a pool of worker processes.
+  @param jobs: number of processes, defaults to the number of cores
+  @return: list of the results
+  """
+  if jobs == 1 or len(args) < 2:
+    return map(func, args)
+  pool = multiprocessing.Pool(jobs)
+  try:
+    return pool.map(func, args, 64)
+  finally:
+    pool.close()
+    pool.join()
+
+def replace_in_file(args):
+  """
+  Replace all occurrences of old with new in a file. The file is only
+  scanned (memory mapped) unless it contains old, and rewritten in place
+  if new has the same length.
+  @param args: (path, old, new)
+  @return: number of replaced occurrences
+  """
+  path, old, new = args
+  with open(path, 'rb') as f:
+    if os.fstat(f.fileno()).st_size == 0:
+      return 0
+    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      if m.find(old) == -1:
+        return 0
+      if len(new) != len(old):
+        data = m[:]
+    finally:
+      m.close()
+
+  if len(new) != len(old):
+    with open(path, 'wb') as f:
+      f.write(data.replace(old, new))
+    return data.count(old)
+
+  count = 0
+  with open(path, 'r+b') as f:
+    m = mmap.mmap(f.fileno(), 0)
+    try:
+      pos = m.find(old)
+      while pos != -1:
+        m[pos:pos + len(old)] = new
+        count += 1
+        pos = m.find(old, pos + len(old))
+      m.flush()
+    finally:
+      m.close()
+  return count
+
+def relocate(files, old, new, jobs=None):
+  """
+  Replace old with new in all files.
+  @return: number of files which have been changed
+  """
+  counts = process_files(replace_in_file, [(f, old, new) for f in files], jobs)
+  return len([c for c in counts if c])
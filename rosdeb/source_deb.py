@@ -33,8 +33,11 @@
 # Revision $Id: __init__.py 10652 2010-08-11 22:01:37Z kwc $
 from __future__ import with_statement
 
+import multiprocessing
 import os
+import re
 import sys
+import tarfile
 import time
 from subprocess import check_call
 import hashlib
@@ -42,14 +45,94 @@ import hashlib
 import yaml
 
 from rosdeb.core import debianize_name
+from buildfarm.stack_info import load_stack_info, stack_info_url
 
-def make_source_deb(distro_name, stack_name, stack_version, os_platform_name, staging_dir):
+_template_rx = re.compile(r'\$\{(ROS_DISTRO_NAME|ROS_STACK_NAME|ROS_STACK_DEBIAN_NAME|ROS_STACK_VERSION)\}')
+
+def make_source_deb(distro_name, stack_name, stack_version, os_platform_name, staging_dir, use_dpkg=True):
     """
     @param os_platform_name: Name of OS platform/version, e.g. 'lucid'
     @type  os_platform_name: str
+    @param use_dpkg: build the source package with dpkg-buildpackage,
+      otherwise write the .dsc and .tar.gz directly
+    @type  use_dpkg: bool
     @return: list of source-deb files
     @rtype: [str]
     """
+    metadata = load_control(distro_name, stack_name, stack_version, staging_dir)
+    payload = render_stack_files(distro_name, stack_name, stack_version, staging_dir)
+    return write_source_deb(distro_name, stack_name, stack_version, os_platform_name, staging_dir,
+                            metadata, payload, use_dpkg)
+
+def make_source_debs(distro_name, stacks, os_platform_names, staging_dir, use_dpkg=True, jobs=None):
+    """
+    Make the source debs of several stacks for several platforms in a
+    pool of worker processes.  The tarball and control YAML of each
+    stack must be in staging_dir, the source debs of each platform are
+    written to the subdirectory staging_dir/os_platform_name.
+    @param stacks: list of (stack_name, stack_version)
+    @param jobs: number of processes, defaults to the number of cores
+    @return: source-deb files for each (stack_name, os_platform_name)
+    @rtype: {(str, str): [str]}
+    """
+    args = [(distro_name, stack_name, stack_version, os_platform_names, staging_dir, use_dpkg)
+            for stack_name, stack_version in stacks]
+    if jobs == 1 or len(args) < 2:
+        results = map(_make_stack_source_debs, args)
+    else:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(_make_stack_source_debs, args, 1)
+        finally:
+            pool.close()
+            pool.join()
+    files = {}
+    for r in results:
+        files.update(r)
+    return files
+
+def _make_stack_source_debs(args):
+    distro_name, stack_name, stack_version, os_platform_names, staging_dir, use_dpkg = args
+    metadata = load_control(distro_name, stack_name, stack_version, staging_dir)
+    payload = render_stack_files(distro_name, stack_name, stack_version, staging_dir)
+    files = {}
+    for os_platform_name in os_platform_names:
+        platform_dir = os.path.join(staging_dir, os_platform_name)
+        if not os.path.isdir(platform_dir):
+            try:
+                os.makedirs(platform_dir)
+            except OSError:
+                if not os.path.isdir(platform_dir):
+                    raise
+        files[(stack_name, os_platform_name)] = write_source_deb(
+            distro_name, stack_name, stack_version, os_platform_name, platform_dir,
+            metadata, payload, use_dpkg)
+    return files
+
+def load_control(distro_name, stack_name, stack_version, staging_dir):
+    """
+    Read the control YAML data of a stack from the staging directory.
+    @return: stack metadata
+    @rtype: dict
+    """
+    control_yaml = os.path.join(staging_dir, '%s-%s.yaml'%(stack_name, stack_version))
+    with open(control_yaml, 'r') as f:
+        metadata = yaml.load(f.read())
+    if not type(metadata) == dict:
+        raise Exception("invalid control file: %s\nMetadata is [%s]"%(control_yaml, metadata))
+
+    # make distro-specific
+    metadata['package'] = 'ros-%s-%s'%(distro_name, debianize_name(stack_name))
+    return metadata
+
+def render_stack_files(distro_name, stack_name, stack_version, staging_dir):
+    """
+    Render the platform independent files of a stack's source deb: the
+    templates from resources/source_deb and the checksums of the stack
+    tarball in staging_dir.
+    @return: list of (path relative to the stack dir, text, mode)
+    @rtype: [(str, str, int)]
+    """
     debian_name = 'ros-%s-%s'%(distro_name, debianize_name(stack_name))
 
     tmpl_d = os.path.join(os.path.dirname(__file__), 'resources', 'source_deb')
@@ -61,57 +144,71 @@ def make_source_deb(distro_name, stack_name, stack_version, os_platform_name, st
     # keep track of files we've copied in to modify
     files = []
     
-    # make STACK/debian
-    stack_d  = os.path.join(staging_dir, stack_name)
-    debian_d = os.path.join(stack_d, 'debian')
-    if not os.path.exists(debian_d):
-        os.makedirs(debian_d)
-
     # Files which go into debian dir
     for f in ['rules', 'compat', 'postinst']:
-        files.append( (os.path.join(tmpl_d, f), os.path.join(debian_d, f)) )
+        files.append( (os.path.join(tmpl_d, f), os.path.join('debian', f)) )
 
     # Files which go into stack dir
-    for f in ['fixpc.py', 'fixbinpath.py', 'fixrpath.py', 'Makefile', 'setup_deb.sh', 'purge_build.py', 'update_version.py', 'gen_versioned_debs.py']:
-        files.append( (os.path.join(tmpl_d, f), os.path.join(stack_d, f)) )
+    for f in ['fixpc.py', 'fixbinpath.py', 'fixrpath.py', 'relocate.py', 'Makefile', 'setup_deb.sh', 'purge_build.py', 'update_version.py', 'gen_versioned_debs.py']:
+        files.append( (os.path.join(tmpl_d, f), f) )
         
     # Files which go into stack dir and are different for ros stack
     if stack_name == 'ros':
         for f in ['setup_deb.sh', 'Makefile']:
             f_src = f+'-ros'
-            files.append( (os.path.join(tmpl_d, f_src), os.path.join(stack_d, f)) )
+            files.append( (os.path.join(tmpl_d, f_src), f) )
                       
     # Files which go into stack dir and only exist for ros
     if stack_name == 'ros':
         for f in ['setup.sh','setup.bash','setup.zsh','.rosinstall']:
-            files.append( (os.path.join(tmpl_d, f), os.path.join(stack_d, f)))
+            files.append( (os.path.join(tmpl_d, f), f) )
 
+    values = {
+        'ROS_DISTRO_NAME': distro_name,
+        'ROS_STACK_NAME': stack_name,
+        'ROS_STACK_DEBIAN_NAME': debian_name,
+        'ROS_STACK_VERSION': stack_version,
+    }
+    payload = []
     for src, dst in files:
         with open(src, 'r') as f:
             src_text = f.read()
+        payload.append((dst, _template_rx.sub(lambda m: values[m.group(1)], src_text), os.stat(src).st_mode))
 
-        dst_text = src_text.replace('${ROS_DISTRO_NAME}', distro_name)
-        dst_text = dst_text.replace('${ROS_STACK_NAME}', stack_name)
-        dst_text = dst_text.replace('${ROS_STACK_DEBIAN_NAME}', debian_name)
-        dst_text = dst_text.replace('${ROS_STACK_VERSION}', stack_version)
-        with open(dst, 'w') as f:
-            f.write(dst_text)
+    # MD5Sum and SHA256Sum of original stack tar.bz2:
+    size, checksums = file_checksums(tarball, ['md5', 'sha256'])
+    for algorithm in ['md5', 'sha256']:
+        payload.append(('%s-%s.%s'%(stack_name, stack_version, algorithm),
+                        '%s  %s\n'%(checksums[algorithm], '../%s-%s.tar.bz2'%(stack_name, stack_version)),
+                        0644))
+    return payload
 
-        # copy permission modes
-        s = os.stat(src)
-        os.chmod(dst, s.st_mode)
-            
-    # CONTROL: read in the control YAML data and convert it to an actual control file
-    control_yaml = os.path.join(staging_dir, '%s-%s.yaml'%(stack_name, stack_version))
-    with open(control_yaml, 'r') as f:
-        metadata = yaml.load(f.read())
-    if not type(metadata) == dict:
-        raise Exception("invalid control file: %s\nMetadata is [%s]"%(control_yaml, metadata))
+def write_source_deb(distro_name, stack_name, stack_version, os_platform_name, staging_dir, metadata, payload, use_dpkg=True):
+    """
+    Write the source deb of a stack for one platform.
+    @param metadata: stack metadata from L{load_control()}
+    @param payload: stack files from L{render_stack_files()}
+    @return: list of source-deb files
+    @rtype: [str]
+    """
+    debian_name = metadata['package']
 
-    # make distro-specific
-    metadata['package'] = debian_name
+    # make STACK/debian
+    stack_d  = os.path.join(staging_dir, stack_name)
+    debian_d = os.path.join(stack_d, 'debian')
+    if not os.path.exists(debian_d):
+        os.makedirs(debian_d)
+
+    for dst, text, mode in payload:
+        dst = os.path.join(stack_d, dst)
+        with open(dst, 'w') as f:
+            f.write(text)
+        os.chmod(dst, mode)
+
+    # CONTROL: convert the control YAML data to an actual control file
+    control_text = control_file(metadata, distro_name, os_platform_name).encode('utf-8')
     with open(os.path.join(debian_d, 'control'), 'w') as f:
-        f.write(control_file(metadata, distro_name, os_platform_name).encode('utf-8'))
+        f.write(control_text)
 
     # CHANGELOG
     with open(os.path.join(debian_d, 'changelog'), 'w') as f:
@@ -123,25 +220,115 @@ def make_source_deb(distro_name, stack_name, stack_version, os_platform_name, st
     with open(os.path.join(debian_d, 'changelog.tmp'), 'w') as f:
         f.write(changelog_file(metadata, os_platform_name, build_version))
     
-    # MD5Sum of original stack tar.bz2:
-    with open(os.path.join(stack_d, '%s-%s.md5'%(stack_name, stack_version)),'w') as mf:
-        with open(os.path.join(staging_dir, '%s-%s.tar.bz2'%(stack_name, stack_version)),'r') as f:
-            m = hashlib.md5()
-            m.update(f.read())
-            mf.write('%s  %s\n'%(m.hexdigest(), '../%s-%s.tar.bz2'%(stack_name, stack_version)))
-
-    # Note: this creates 3 files.  A .dsc, a .tar.gz, and a .changes
-    check_call(['dpkg-buildpackage', '-S', '-uc', '-us'], cwd=stack_d)
-
+    deb_version = "%s-0~%s"%(stack_version, os_platform_name)
+    if use_dpkg:
+        # Note: this creates 3 files.  A .dsc, a .tar.gz, and a .changes
+        check_call(['dpkg-buildpackage', '-S', '-uc', '-us'], cwd=stack_d)
+    else:
+        write_source_package(stack_d, staging_dir, debian_name, deb_version, control_text)
 
     # SOURCE DEB: .dsc plus tarball of debian dir. Ignore the changes for now
-    f_name  = "%s_%s-0~%s"%(debian_name, stack_version, os_platform_name)
+    f_name  = "%s_%s"%(debian_name, deb_version)
     files = [os.path.join(staging_dir, f_name+ext) for ext in ('.dsc', '.tar.gz')]
     for f in files:
         assert os.path.exists(f), "File: %s does not exist"%f
 
     return files
     
+def file_checksums(path, algorithms, chunk_size=1 << 20):
+    """
+    Compute several checksums of a file in one pass without reading it
+    into memory at once.
+    @param algorithms: names of hashlib algorithms, e.g. ['md5', 'sha256']
+    @return: size of the file and dict mapping each algorithm to the hex digest
+    @rtype: (int, {str: str})
+    """
+    hashes = [(a, hashlib.new(a)) for a in algorithms]
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            for _, h in hashes:
+                h.update(chunk)
+    return size, dict([(a, h.hexdigest()) for a, h in hashes])
+
+def parse_control(control_text):
+    """
+    @return: paragraphs of a debian control file as lists of (field, value)
+    @rtype: [[(str, str)]]
+    """
+    paragraphs = []
+    fields = []
+    for l in control_text.splitlines():
+        if not l.strip():
+            if fields:
+                paragraphs.append(fields)
+            fields = []
+        elif fields and (l[0] in ' \t' or ':' not in l):
+            fields[-1] = (fields[-1][0], fields[-1][1] + '\n' + l)
+        else:
+            field, value = l.split(':', 1)
+            fields.append((field, value.strip()))
+    if fields:
+        paragraphs.append(fields)
+    return paragraphs
+
+def write_source_package(stack_d, staging_dir, debian_name, deb_version, control_text):
+    """
+    Write the .dsc and .tar.gz of a native 1.0 source package from
+    stack_d into staging_dir, like 'dpkg-source -b' does.
+    @return: list of source-deb files
+    @rtype: [str]
+    """
+    f_name = "%s_%s"%(debian_name, deb_version)
+    upstream_version = deb_version.rsplit('-', 1)[0]
+
+    def reset_owner(tarinfo):
+        tarinfo.uid = tarinfo.gid = 0
+        tarinfo.uname = tarinfo.gname = 'root'
+        return tarinfo
+
+    tar_name = f_name + '.tar.gz'
+    tar = tarfile.open(os.path.join(staging_dir, tar_name), 'w:gz')
+    try:
+        tar.add(stack_d, arcname='%s-%s'%(debian_name, upstream_version), filter=reset_owner)
+    finally:
+        tar.close()
+    size, checksums = file_checksums(os.path.join(staging_dir, tar_name), ['md5', 'sha1', 'sha256'])
+
+    paragraphs = parse_control(control_text)
+    source = dict(paragraphs[0])
+    binaries = [dict(p) for p in paragraphs[1:]]
+    architectures = []
+    for b in binaries:
+        for a in b['Architecture'].split():
+            if a not in architectures:
+                architectures.append(a)
+
+    fields = [
+        ('Format', '1.0'),
+        ('Source', source['Source']),
+        ('Binary', ', '.join([b['Package'] for b in binaries])),
+        ('Architecture', ' '.join(architectures)),
+        ('Version', deb_version),
+        ('Maintainer', source['Maintainer']),
+    ]
+    for field in ['Homepage', 'Standards-Version', 'Build-Depends', 'Build-Depends-Indep']:
+        if field in source:
+            fields.append((field, source[field]))
+    fields.append(('Checksums-Sha1', '\n %s %s %s'%(checksums['sha1'], size, tar_name)))
+    fields.append(('Checksums-Sha256', '\n %s %s %s'%(checksums['sha256'], size, tar_name)))
+    fields.append(('Files', '\n %s %s %s'%(checksums['md5'], size, tar_name)))
+
+    dsc_name = f_name + '.dsc'
+    with open(os.path.join(staging_dir, dsc_name), 'w') as f:
+        for field, value in fields:
+            f.write('%s:%s%s\n'%(field, '' if value.startswith('\n') else ' ', value))
+    return [os.path.join(staging_dir, dsc_name), os.path.join(staging_dir, tar_name)]
+
 def supported_platforms(control):
     return [version for version in control['rosdeps'].keys()]
     
@@ -200,11 +387,9 @@ def stack_depends(metadata, distro_name, platform_name):
     return stackdeps
         
 def download_control(stack_name, stack_version):
-    url = 'https://code.ros.org/svn/release/download/stacks/%(stack_name)s/%(stack_name)s-%(stack_version)s/%(stack_name)s-%(stack_version)s.yaml'
-    url = url%locals()
-    import urllib2
+    url = stack_info_url(stack_name, stack_version)
     try:
-        return yaml.load(urllib2.urlopen(url))
+        return load_stack_info(stack_name, stack_version)
     except:
         raise Exception("Problem fetching yaml info for %s %s (% s).\nThis yaml info is usually created when a release is uploaded. If it is missing, either the stack version is wrong, or the release did not occur correctly."%(stack_name, stack_version, url))
 
@@ -229,7 +414,7 @@ def control_file(metadata, distro_name, platform_name):
 Section: unknown
 Priority: %(priority)s
 Maintainer: %(maintainer)s
-Build-Depends: debhelper (>= 5), chrpath, %(all-depends)s
+Build-Depends: debhelper (>= 5), %(all-depends)s
 Standards-Version: 3.7.2
 XBC-WG-rosdistro: %(distro_name)s
 
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import argparse
+
+import buildfarm.apt_proxy
+
+def parse_options():
+    parser = argparse.ArgumentParser(
+             description='run a http proxy for apt which caches the downloaded packages on disk')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=buildfarm.apt_proxy.DEFAULT_CACHE_DIR,
+           help='The directory to keep the downloaded packages in')
+    parser.add_argument('--host', dest='host', default='localhost',
+           help='The address to listen on')
+    parser.add_argument('--port', dest='port', type=int, default=buildfarm.apt_proxy.DEFAULT_PORT,
+           help='The port to listen on')
+    return parser.parse_args()
+
+
+def doit():
+    args = parse_options()
+    buildfarm.apt_proxy.run_proxy(args.cache_dir, args.host, args.port)
+
+
+if __name__ == "__main__":
+    doit()
@@ -13,7 +13,6 @@ import rospkg.distro
 from buildfarm.release_jobs import get_targets, debianize_package_name
 from buildfarm.release_jobs import JobParams, PackageParams
 from rosdistro.rosdistro import RosDistro
-from rosdep2 import rospack
 
 def parse_options():
     parser = argparse.ArgumentParser(
@@ -155,20 +154,6 @@ def doit(job_params, dry_maintainers, packages, rosdist_rep,
 
     return results
 
-def get_dependencies(rd, packages):
-    dependencies = {}
-    v = rospack.init_rospack_interface()
-    for p in packages:
-        deps = rd.get_depends(p)
-        dp = debianize_package_name(rd.name, p)
-        dependencies[dp] = []
-        combined_deps = set(deps['build']) | set(deps['run'])
-        for d in combined_deps:
-            if not rospack.is_system_dependency(v, d):
-                dependencies[dp].append(debianize_package_name(rd.name, d))
-    return dependencies
-
-
 if __name__ == '__main__':
     args = parse_options()
 
@@ -184,7 +169,7 @@ if __name__ == '__main__':
 
     if args.rosdistro != 'fuerte':
         packages = rd.get_packages()
-        dependencies = get_dependencies(rd, packages)
+        dependencies = release_jobs.get_dependencies(rd, packages)
     else:
         from buildfarm import dependency_walker_fuerte
         stacks = dependency_walker_fuerte.get_stacks(workspace, rd.distro_file.repositories, args.rosdistro, skip_update=args.skip_update)
@@ -199,16 +184,9 @@ if __name__ == '__main__':
         dry_jobgraph = release_jobs.dry_generate_jobgraph(args.rosdistro, dependencies, stack_depends)
     else:
         dry_maintainers = []
+        dry_jobgraph = None
 
-    combined_jobgraph = {}
-    for k, v in dependencies.iteritems():
-        combined_jobgraph[k] = v
-    if not args.wet_only:
-        for k, v in dry_jobgraph.iteritems():
-            combined_jobgraph[k] = v
-
-    # setup a job triggered by all other debjobs
-    combined_jobgraph[debianize_package_name(args.rosdistro, 'metapackages')] = combined_jobgraph.keys()
+    combined_jobgraph = release_jobs.combine_jobgraphs(args.rosdistro, dependencies, dry_jobgraph)
 
     targets = get_targets(rd, args.distros, args.arches)
     jp = JobParams(rosdistro=args.rosdistro,
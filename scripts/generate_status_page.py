@@ -7,43 +7,28 @@ import os
 import sys
 import time
 
-from buildfarm.status_page import bin_arches, build_repo_caches, get_distro_arches, render_csv, ros_repos, transform_csv_to_html
+from buildfarm.status_page import bin_arches, build_repo_caches, get_multi_distro_arches, get_ros_pkgs_from_apt_caches, make_json_data, make_status_html, render_csv, ros_repos, transform_csv_to_table
 
 
 def parse_options(args=sys.argv[1:]):
     p = argparse.ArgumentParser(description='Generate the HTML page showing the package build status.')
     p.add_argument('--basedir', default='/tmp/build_status_page', help='Root directory containing ROS apt caches. This should be created using the build_caches command.')
     p.add_argument('--skip-fetch', action='store_true', help='Skip fetching the apt data.')
+    p.add_argument('--full-update', action='store_true', help='Update the lists of all apt sources, not only the ROS repos, even if the apt caches are already set up.')
     p.add_argument('--skip-csv', action='store_true', help='Skip generating .csv file.')
-    p.add_argument('rosdistro', default='groovy', help='The ROS distro to generate the status page for (i.e. groovy).')
+    p.add_argument('--inline-data', action='store_true', help='Embed all rows into the .html file instead of loading them from the generated .json file.')
+    p.add_argument('--blocked-by', action='store_true', help='Annotate missing packages with the missing upstream packages blocking them (requires the release job dependencies).')
+    p.add_argument('--rosdistro', dest='rosdist_rep', default='https://raw.github.com/ros/rosdistro/master/', help='The base path to a rosdistro repository used for --blocked-by. Default: %(default)s')
+    p.add_argument('rosdistros', metavar='rosdistro', nargs='+', help='The ROS distros to generate the status page for (i.e. groovy). The apt data is only fetched and read once for all of them.')
     return p.parse_args(args)
 
 
-if __name__ == '__main__':
-    args = parse_options()
-
-    start_time = time.localtime()
-
-    if not args.skip_fetch:
-        print('Fetching apt data (this will take some time)...')
-        build_repo_caches(args.basedir, ros_repos, get_distro_arches(bin_arches, args.rosdistro))
-    else:
-        print('Skip fetching apt data')
-
-    csv_file = os.path.join(args.basedir, '%s.csv' % args.rosdistro)
-    if not args.skip_csv:
-        print('Generating .csv file...')
-        render_csv(args.basedir, csv_file, args.rosdistro)
-    elif not os.path.exists(csv_file):
-        print('.csv file "%s" is missing. Call script without "--skip-csv".' % csv_file, file=sys.stderr)
-    else:
-        print('Skip generating .csv file')
-
+def get_metadata_builder(rosdistro):
     def metadata_builder(column_data):
         distro, jobtype = column_data.split('_', 1)
         data = {
-            'rosdistro': args.rosdistro,
-            'rosdistro_short': args.rosdistro[0].upper(),
+            'rosdistro': rosdistro,
+            'rosdistro_short': rosdistro[0].upper(),
             'distro': distro,
             'distro_short': distro[0].upper()
         }
@@ -66,13 +51,23 @@ if __name__ == '__main__':
         data['job_url'] = ('{view_url}job/%s/' % job_name).format(**data)
 
         return data
+    return metadata_builder
+
 
-    print('Transforming .csv into .html file...')
-    with open(csv_file, 'r') as f:
-        html = transform_csv_to_html(f, metadata_builder, args.rosdistro, start_time)
-    html_file = os.path.join(args.basedir, '%s.html' % args.rosdistro)
-    with open(html_file, 'w') as f:
-        f.write(html)
+if __name__ == '__main__':
+    args = parse_options()
+
+    start_time = time.localtime()
+
+    if not args.skip_fetch:
+        print('Fetching apt data (this will take some time)...')
+        build_repo_caches(args.basedir, ros_repos, get_multi_distro_arches(bin_arches, args.rosdistros), args.full_update)
+    else:
+        print('Skip fetching apt data')
+
+    if not args.skip_csv:
+        print('Reading apt data...')
+        rosdistro_pkgs = get_ros_pkgs_from_apt_caches(args.basedir, args.rosdistros)
 
     print('Symlinking jQuery resources...')
     dst = os.path.join(args.basedir, 'jquery')
@@ -80,4 +75,36 @@ if __name__ == '__main__':
         src = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'resources', 'jquery')
         os.symlink(src, dst)
 
-    print('Generated .html file "%s"' % html_file)
+    for rosdistro in args.rosdistros:
+        csv_file = os.path.join(args.basedir, '%s.csv' % rosdistro)
+        if not args.skip_csv:
+            print('Generating .csv file for %s...' % rosdistro)
+            render_csv(args.basedir, csv_file, rosdistro, rosdistro_pkgs[rosdistro])
+        elif not os.path.exists(csv_file):
+            print('.csv file "%s" is missing. Call script without "--skip-csv".' % csv_file, file=sys.stderr)
+            continue
+        else:
+            print('Skip generating .csv file for %s' % rosdistro)
+
+        jobgraph = None
+        if args.blocked_by:
+            from buildfarm.release_jobs import get_jobgraph
+            print('Computing the jobgraph for %s...' % rosdistro)
+            jobgraph = get_jobgraph(rosdistro, args.rosdist_rep)
+
+        print('Transforming .csv into .html file...')
+        with open(csv_file, 'r') as f:
+            header, counts, rows, source_columns = transform_csv_to_table(f, get_metadata_builder(rosdistro), rosdistro, jobgraph)
+        if not args.inline_data:
+            json_file = os.path.join(args.basedir, '%s.json' % rosdistro)
+            print('Writing rows into .json file...')
+            with open(json_file, 'w') as f:
+                f.write(make_json_data(rows))
+            html = make_status_html(header, counts, rows, rosdistro, start_time, os.path.basename(json_file), source_columns)
+        else:
+            html = make_status_html(header, counts, rows, rosdistro, start_time, hidden_columns=source_columns)
+        html_file = os.path.join(args.basedir, '%s.html' % rosdistro)
+        with open(html_file, 'w') as f:
+            f.write(html)
+
+        print('Generated .html file "%s"' % html_file)
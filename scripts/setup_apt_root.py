@@ -12,6 +12,8 @@ def parse_options():
            help='The url for the default repo, like --mirror to debootstrap')
     parser.add_argument('--repo', dest='repo_urls', action='append',metavar=['REPO_NAME@REPO_URL'],
            help='The name for the source and the url such as ros@http://50.28.27.175/repos/building')
+    parser.add_argument('--http-proxy', dest='proxy', action='store',
+           help='A http proxy to download packages through, like the one of apt_cache_proxy.py')
     parser.add_argument(dest='distro',
            help='The debian release distro, lucid, oneiric, etc')
     parser.add_argument(dest='architecture',
@@ -40,9 +42,9 @@ def doit():
 
     ros_repos = buildfarm.apt_root.parse_repo_args(args.repo_urls)
 
-    buildfarm.apt_root.setup_apt_rootdir(args.rootdir, args.distro, args.architecture, mirror= args.mirror, additional_repos = ros_repos)
+    buildfarm.apt_root.setup_apt_rootdir(args.rootdir, args.distro, args.architecture, mirror= args.mirror, additional_repos = ros_repos, proxy = args.proxy)
     if args.local_conf:
-        buildfarm.apt_root.setup_conf(args.rootdir, args.local_conf)
+        buildfarm.apt_root.setup_conf(args.rootdir, args.local_conf, proxy = args.proxy)
 
 
 if __name__ == "__main__":
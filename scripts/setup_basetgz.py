@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import argparse
+import sys
+
+import buildfarm.basetgz_cache
+
+def parse_options():
+    parser = argparse.ArgumentParser(
+             description='create or update a cached pbuilder base tarball or cowbuilder base directory and print its path')
+    parser.add_argument('--mirror', dest='mirror', action='store', default='http://us.archive.ubuntu.com/ubuntu/',
+           help='The url for the default repo, like --mirror to debootstrap')
+    parser.add_argument('--debootstrap', dest='debootstrap', action='store', default='debootstrap',
+           help='The debootstrap implementation to use, like qemu-debootstrap')
+    parser.add_argument('--aptconfdir', dest='aptconfdir', action='store',
+           help='The apt configuration directory to use in the chroot')
+    parser.add_argument('--http-proxy', dest='proxy', action='store',
+           help='A http proxy to download packages through, like the one of apt_cache_proxy.py')
+    parser.add_argument('--update', dest='update', action='store_true', default=False,
+           help='Update the base tarball if it already exists')
+    parser.add_argument('--backend', dest='backend', choices=sorted(buildfarm.basetgz_cache.BACKENDS.keys()), default='pbuilder',
+           help='Keep a base tarball for pbuilder or an unpacked base directory for cowbuilder')
+    parser.add_argument('--max-cached', dest='max_cached', type=int, default=3,
+           help='The number of base tarballs to keep per distro and arch, older ones are only removed once they have not been used for a day')
+    parser.add_argument(dest='distro',
+           help='The debian release distro, lucid, oneiric, etc')
+    parser.add_argument(dest='architecture',
+           help='The debian binary architecture. amd64, i386, armel')
+    parser.add_argument(dest='cache_dir',
+           help='The directory to keep the base tarballs in')
+    return parser.parse_args()
+
+
+def doit():
+    args = parse_options()
+
+    options = ['--architecture', args.architecture, '--mirror', args.mirror, '--keyring', '/etc/apt/trusted.gpg']
+    if args.aptconfdir:
+        options += ['--aptconfdir', args.aptconfdir]
+    create_options = ['--debootstrap', args.debootstrap, '--debootstrapopts', '--arch=%s' % args.architecture, '--debootstrapopts', '--keyring=/etc/apt/trusted.gpg']
+
+    # stdout only contains the path of the tarball
+    print(buildfarm.basetgz_cache.setup_basetgz(args.cache_dir, args.distro, args.architecture, options, create_options, update=args.update, max_cached=args.max_cached, stdout=sys.stderr, backend=args.backend, proxy=args.proxy))
+
+
+if __name__ == "__main__":
+    doit()
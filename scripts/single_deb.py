@@ -46,12 +46,17 @@ import urllib2
 import stat
 import re
 import time
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 from rospkg.distro import distro_uri, load_distro
 import rosdeb
 from rosdeb import debianize_name, debianize_version, rosdistro, targets, list_missing
 from rosdeb.rosutil import send_email
 from rosdeb.source_deb import download_control
+from buildfarm.basetgz_cache import get_base_option, get_basetgz_path, get_cached_basetgzs, setup_basetgz
+from buildfarm.stack_info import prefetch_stack_infos
 
 NAME = 'build_debs.py'
 TARBALL_URL = "https://code.ros.org/svn/release/download/stacks/%(stack_name)s/%(base_name)s/%(f_name)s"
@@ -59,7 +64,18 @@ TARBALL_URL = "https://code.ros.org/svn/release/download/stacks/%(stack_name)s/%
 REPO_PATH ='/var/www/repos/building'
 REPO_USERNAME='rosbuild'
 
-TGZ_VERSION='dry_6'
+BASETGZ_DIR='/var/cache/pbuilder'
+
+# memory to reserve for each concurrent build
+MEMORY_PER_BUILD = 2 * 1024 ** 3
+
+# concurrent builds share the base tarballs
+_chroot_locks = {}
+_chroot_locks_lock = threading.Lock()
+
+def get_chroot_lock(os_platform, arch):
+    with _chroot_locks_lock:
+        return _chroot_locks.setdefault((os_platform, arch), threading.Lock())
 
 import traceback
 
@@ -136,6 +152,7 @@ def compute_deps(distro, stack_name):
         ordered_deps.append((s,v))
 
     if stack_name == 'ALL':
+        prefetch_stack_infos([(s, distro.released_stacks[s].version) for s in distro.released_stacks.keys()])
         for s in distro.released_stacks.keys():
             try:
                 add_stack(s)
@@ -147,15 +164,12 @@ def compute_deps(distro, stack_name):
 
     return ordered_deps
 
-def create_chroot(distro, distro_name, os_platform, arch, repo_fqdn):
-
-    distro_tgz = os.path.join('/var/cache/pbuilder', "%s-%s-%s.tgz"%(os_platform, arch, TGZ_VERSION))
-
-    if os.path.exists(distro_tgz) and os.path.getsize(distro_tgz) > 0:  # Zero sized file left in place if last build crashed
-        return
-
-    debug("re-creating pbuilder cache")
-
+def create_chroot(distro, distro_name, os_platform, arch, repo_fqdn, backend='pbuilder', proxy=None):
+    """
+    @param backend: 'pbuilder' or 'cowbuilder'
+    @param proxy: http proxy to download packages through
+    @return: path of the base tarball (base directory for cowbuilder) to build in
+    """
     try:
         debug('loading ros stack info')
         ros_info = load_info('ros', distro.released_stacks['ros'].version)
@@ -164,9 +178,6 @@ def create_chroot(distro, distro_name, os_platform, arch, repo_fqdn):
         # mock in data if we are in fuerte+
         ros_info = {'rosdeps': {os_platform: []}}
 
-    # force update of apt index
-    subprocess.check_call(['sudo', 'apt-get', 'update'], stderr=subprocess.STDOUT)
-
     # Things that this build infrastructure depends on
     basedeps = ['wget', 'lsb-release', 'debhelper']
     # Deps we claimed to have needed for building ROS
@@ -196,21 +207,28 @@ def create_chroot(distro, distro_name, os_platform, arch, repo_fqdn):
     shadow_mirror = 'deb %s %s main' % (repo_url(repo_fqdn), os_platform)
     # --othermirror uses a | as a separator
     other_mirror = '%s|%s'%(updates_mirror, shadow_mirror)
+    options = ['--mirror', mirror, '--othermirror', other_mirror, '--components', 'main restricted universe multiverse', '--extrapackages', deplist, '--keyring', '/etc/apt/trusted.gpg']
+    create_options = ['--debootstrap', debootstrap_type, '--debootstrapopts', '--arch=%s'%arch, '--debootstrapopts', '--keyring=/etc/apt/trusted.gpg']
+    distro_tgz = get_basetgz_path(BASETGZ_DIR, os_platform, arch, options, create_options, backend)
+    if distro_tgz in get_cached_basetgzs(BASETGZ_DIR, os_platform, arch, backend):
+        return setup_basetgz(BASETGZ_DIR, os_platform, arch, options, create_options, backend=backend, proxy=proxy)
+
+    debug("re-creating pbuilder cache")
+
+    # force update of apt index
+    subprocess.check_call(['sudo', 'apt-get', 'update'], stderr=subprocess.STDOUT)
+
     command = ['dpkg', '-l', 'pbuilder']
     debug("pbuilder verison : [%s]"%(str(command)))
     subprocess.check_call(command, stderr=subprocess.STDOUT)
 
-    command = ['sudo', 'pbuilder', '--create', '--distribution', os_platform, '--debootstrap', debootstrap_type, '--debootstrapopts', '--arch=%s'%arch, '--mirror', mirror, '--othermirror', other_mirror, '--basetgz', distro_tgz, '--components', 'main restricted universe multiverse', '--extrapackages', deplist]
-    command.extend(['--debootstrapopts', '--keyring=/etc/apt/trusted.gpg', '--keyring', '/etc/apt/trusted.gpg'])
-    debug("Setting up chroot: [%s]"%(str(command)))
-    subprocess.check_call(command, stderr=subprocess.STDOUT)
+    debug("Setting up chroot: [%s %s %s]"%(os_platform, arch, str(options + create_options)))
+    return setup_basetgz(BASETGZ_DIR, os_platform, arch, options, create_options, backend=backend, proxy=proxy)
 
 
-def do_deb_build(distro_name, stack_name, stack_version, os_platform, arch, staging_dir, noupload, interactive, repo_fqdn):
+def do_deb_build(distro_name, stack_name, stack_version, os_platform, arch, staging_dir, noupload, interactive, repo_fqdn, distro_tgz, backend='pbuilder', proxy=None, upload_queue=None):
     debug("Actually trying to build %s-%s..."%(stack_name, stack_version))
 
-    distro_tgz = os.path.join('/var/cache/pbuilder', "%s-%s-%s.tgz"%(os_platform, arch, TGZ_VERSION))
-
     deb_name = "ros-%s-%s"%(distro_name, debianize_name(stack_name))
     deb_version = debianize_version(stack_version, '0', os_platform)
     ros_file = "%s-%s"%(stack_name, stack_version)
@@ -296,6 +314,8 @@ echo "Resuming pbuilder"
             os.chmod(p, stat.S_IRWXU)
 
 
+    proxy_options = ['--http-proxy', proxy] if proxy else []
+
     if arch == 'amd64' or arch == 'armel' or arch == 'armhf':
         archcmd = []
     else:
@@ -303,7 +323,7 @@ echo "Resuming pbuilder"
 
     # Actually build the deb.  This results in the deb being located in results_dir
     debug("starting pbuilder build of %s-%s"%(stack_name, stack_version))
-    subprocess.check_call(archcmd+ ['sudo', 'pbuilder', '--build', '--basetgz', distro_tgz, '--configfile', conf_file, '--hookdir', hook_dir, '--buildresult', results_dir, '--binary-arch', '--buildplace', build_dir, dsc_file], stderr=subprocess.STDOUT)
+    subprocess.check_call(archcmd+ ['sudo', backend, '--build', get_base_option(backend), distro_tgz, '--configfile', conf_file, '--hookdir', hook_dir, '--buildresult', results_dir, '--binary-arch', '--buildplace', build_dir] + proxy_options + [dsc_file], stderr=subprocess.STDOUT)
 
     # Set up an RE to look for the debian file and find the build_version
     deb_version_wild = debianize_version(stack_version, '(\w*)', os_platform)
@@ -345,7 +365,7 @@ dpkg -l %(deb_name)s
 
 
     debug("starting verify script for %s-%s"%(stack_name, stack_version))
-    subprocess.check_call(archcmd + ['sudo', 'pbuilder', '--execute', '--basetgz', distro_tgz, '--configfile', conf_file, '--bindmounts', results_dir, '--buildplace', build_dir, verify_script], stderr=subprocess.STDOUT)
+    subprocess.check_call(archcmd + ['sudo', backend, '--execute', get_base_option(backend), distro_tgz, '--configfile', conf_file, '--bindmounts', results_dir, '--buildplace', build_dir] + proxy_options + [verify_script], stderr=subprocess.STDOUT)
 
     # Upload the debs to the server
     base_files = ['%s_%s.changes'%(deb_file, arch)] # , "%s_%s.deb"%(deb_file_final, arch)
@@ -356,134 +376,149 @@ dpkg -l %(deb_name)s
 
 
     if not noupload:
+        queue = upload_queue or UploadQueue(repo_fqdn)
+        queue.invalidate(deb_name, os_platform, arch)
+        queue.add_changes(files, os_platform)
 
-        invalidate_debs(deb_name, os_platform, arch, repo_fqdn)
-
-        if not upload_debs(files, distro_name, os_platform, arch, repo_fqdn):
+        if upload_queue is None and not queue.flush():
             print "Upload of debs failed!!!"
             return 1
     return 0
 
 
-def invalidate_debs(package, os_platform, arch, repo_fqdn):
-    repo_path = REPO_PATH
-#    cmd = "/usr/bin/reprepro -b %(repo_path)s -T deb -V listfilter %(os_platform)s \" ( Package (== %(package)s ), Architecture (== %(arch)s ) ) | (Architecture (== %(arch)s ), ( Depends ($ %(package)s,* ) | Depends ($ *%(package)s ) )\" "%locals()
-
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(repo_fqdn, username='rosbuild')
-
-    # remove all dependencies
-    cmd = "/usr/bin/reprepro -b %(repo_path)s -T deb -V removefilter %(os_platform)s \"Architecture (== %(arch)s ), Depends ($ *%(package)s[ ,]* ) | Depends ($ *%(package)s )\" "%locals()
-    cmd = cmd.replace('$', '%')
-
-    print "Invalidation command: ", cmd
-    stdin, stdout, stderr = ssh.exec_command(cmd)
-    print "Invalidation results:", stdout.readlines(), stderr.readlines()
-
-    # remove the package itseif
-    cmd = "/usr/bin/reprepro -b %(repo_path)s -T deb -V removefilter %(os_platform)s \"Package (== %(package)s ), Architecture (== %(arch)s ) \" "%locals()
-
-
-    print "Invalidation command: ", cmd
-    stdin, stdout, stderr = ssh.exec_command(cmd)
-    print "Invalidation results:", stdout.readlines(), stderr.readlines()
-    ssh.close()
-
-
-def upload_debs(files, distro_name, os_platform, arch, repo_fqdn):
-    replace_elements  = {}
-    replace_elements['repo_hostname'] = repo_fqdn
-    replace_elements['repo_incoming_path'] = os.path.join(REPO_PATH, 'queue', os_platform)
-    replace_elements['repo_path'] = REPO_PATH
-    replace_elements['distro'] = os_platform
-    replace_elements['repo_username'] = REPO_USERNAME
-
-    try:
-        tf_name = None
-        with tempfile.NamedTemporaryFile(delete=False)  as tf:
-            tf.write("""
-[debtarget]
-method                  = scp
-login                   = %(repo_username)s
-fqdn                    = %(repo_hostname)s
-incoming                = %(repo_incoming_path)s
-run_dinstall            = 0
-post_upload_command     = ssh %(repo_username)s@%(repo_hostname)s -- /usr/bin/reprepro -b %(repo_path)s --ignore=emptyfilenamepart -V processincoming %(distro)s
-""" % replace_elements)
-            tf_name = tf.name
-
-        ret_val = subprocess.call(['cat', tf_name])
-        cmd = ['dput', '-u', '-c', tf_name, 'debtarget' ]
-        cmd.extend(files)
-        print "Uploading with command: %s" % cmd
-        subprocess.check_call(cmd)
-    finally:
-        if tf_name:
-            if os.path.exists(tf_name):
-                os.remove(tf_name)
-
-    return ret_val == 0
-
-
-#    if res != 0:
-#        debug("ERROR: Could not run upload script")
-#        debug("ERROR: output of upload script: %s"%o)
-#        return 1
-#    else:
-#        return 0
-
-            # The cache is no longer valid, we clear it so that we won't skip debs that have been invalidated
-            # ??? What was this doing?
-            #rosdeb.repo._Packages_cache = {}
-
-def upload_binary_debs(files, distro_name, os_platform, arch, repo_fqdn):
-
-    if len(files) == 0:
-        debug("No debs to upload.")
-        return 1 # no files to upload
-
-    subprocess.check_call(['scp'] + files + ['%s@%s:%s/queue/%s'%(REPO_USERNAME, repo_fqdn, REPO_PATH, os_platform)], stderr=subprocess.STDOUT)
-
-    base_files = [x.split('/')[-1] for x in files]
-
-
-    new_files = ' '.join(os.path.join('%s/queue'%(REPO_PATH),os_platform,x) for x in base_files)
-
-
-    # load repo_path into locals for substitution below
-    repo_path = REPO_PATH
-
-    # This script moves files into queue directory, removes all dependent debs, removes the existing deb, and then processes the incoming files
-    remote_cmd = "TMPFILE=`mktemp` || exit 1 && cat > ${TMPFILE} && chmod +x ${TMPFILE} && ${TMPFILE}; ret=${?}; rm ${TMPFILE}; exit ${ret}"
-    run_script = subprocess.Popen(['ssh', "%s@%s"%(REPO_USERNAME, repo_fqdn), remote_cmd], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    script_content = """
-#!/bin/bash
+class UploadQueue(object):
+    """
+    Collects the invalidations and uploads of several builds and applies
+    them at once: all files are copied over one ssh connection and the
+    repository is updated by a single script holding the repository lock.
+    Invalidations are applied before any upload, so the builds of one
+    flush must not depend on each other.
+    """
+
+    def __init__(self, repo_fqdn):
+        self.repo_fqdn = repo_fqdn
+        self.invalidations = []
+        self.changes = []
+        self.debs = []
+        self.lock = threading.Lock()
+
+    def invalidate(self, package, os_platform, arch):
+        """
+        Remove the package and all debs depending on it.
+        """
+        with self.lock:
+            self.invalidations.append((package, os_platform, arch))
+
+    def add_changes(self, files, os_platform):
+        """
+        Upload the source packages described by .changes files.
+        """
+        with self.lock:
+            self.changes.append((os_platform, files))
+
+    def add_debs(self, files, os_platform):
+        """
+        Upload binary debs.
+        """
+        with self.lock:
+            self.debs.append((os_platform, files))
+
+    def get_script(self):
+        repo_path = REPO_PATH
+        lines = []
+        for package, os_platform, arch in self.invalidations:
+            # remove all dependencies
+            cmd = "/usr/bin/reprepro -b %(repo_path)s -T deb -V removefilter %(os_platform)s \"Architecture (== %(arch)s ), Depends ($ *%(package)s[ ,]* ) | Depends ($ *%(package)s )\" "%locals()
+            lines.append(cmd.replace('$', '%') + '|| true')
+            # remove the package itseif
+            lines.append("/usr/bin/reprepro -b %(repo_path)s -T deb -V removefilter %(os_platform)s \"Package (== %(package)s ), Architecture (== %(arch)s ) \" || true"%locals())
+        for os_platform in sorted(set([p for p, _ in self.changes])):
+            lines.append("/usr/bin/reprepro -b %(repo_path)s --ignore=emptyfilenamepart -V processincoming %(os_platform)s"%locals())
+        for os_platform, files in self.debs:
+            new_files = ' '.join(self._get_queue_path(os_platform, f) for f in files)
+            lines.append("/usr/bin/reprepro -V -b %(repo_path)s includedeb %(os_platform)s %(new_files)s"%locals())
+            lines.append("rm %(new_files)s"%locals())
+        return """#!/bin/bash
 set -o errexit
 (
 flock 200
-reprepro -V -b %(repo_path)s includedeb %(os_platform)s %(new_files)s
-rm %(new_files)s
+%s
 ) 200>/var/lock/ros-shadow.lock
-"""%locals()
-
-    #Actually run script and check result
-    (o,e) = run_script.communicate(script_content)
-    res = run_script.wait()
-    debug("result of run script: %s"%o)
-    if res != 0:
-        debug("ERROR: Could not run upload script")
-        debug("ERROR: output of upload script: %s"%o)
-        return 1
-    else:
-        return 0
+"""%('\n'.join(lines))
+
+    def _get_queue_path(self, os_platform, f):
+        return os.path.join(REPO_PATH, 'queue', os_platform, os.path.basename(f))
+
+    def _get_upload_files(self):
+        files = []
+        for os_platform, changes_files in self.changes:
+            for changes_file in changes_files:
+                files.extend([(os_platform, f) for f in get_changes_files(changes_file)])
+                files.append((os_platform, changes_file))
+        for os_platform, debs in self.debs:
+            files.extend([(os_platform, f) for f in debs])
+        return files
+
+    def flush(self):
+        """
+        @return: True if the repository has been updated successfully
+        """
+        with self.lock:
+            if not self.invalidations and not self.changes and not self.debs:
+                return True
+            script = self.get_script()
+            files = self._get_upload_files()
+            self.invalidations, self.changes, self.debs = [], [], []
+
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect(self.repo_fqdn, username=REPO_USERNAME)
+        try:
+            if files:
+                sftp = ssh.open_sftp()
+                for os_platform, f in files:
+                    debug("Uploading %s"%(f))
+                    sftp.put(f, self._get_queue_path(os_platform, f))
+                sftp.close()
+
+            debug("Running repository update script:\n%s"%(script))
+            remote_cmd = "TMPFILE=`mktemp` || exit 1 && cat > ${TMPFILE} && chmod +x ${TMPFILE} && ${TMPFILE}; ret=${?}; rm ${TMPFILE}; exit ${ret}"
+            stdin, stdout, stderr = ssh.exec_command(remote_cmd)
+            stdin.write(script)
+            stdin.channel.shutdown_write()
+            o = stdout.read() + stderr.read()
+            res = stdout.channel.recv_exit_status()
+        finally:
+            ssh.close()
+        debug("result of update script: %s"%o)
+        if res != 0:
+            debug("ERROR: Could not run update script")
+            return False
+        return True
+
+
+def get_changes_files(changes_file):
+    """
+    @return: paths of the files listed in a .changes file
+    """
+    files = []
+    in_files = False
+    with open(changes_file) as f:
+        for l in f:
+            if l.startswith('Files:'):
+                in_files = True
+            elif in_files and l.startswith(' '):
+                files.append(os.path.join(os.path.dirname(changes_file), l.split()[-1]))
+            else:
+                in_files = False
+    return files
 
 
 def debug(msg):
     print "[build_debs]: %s"%(msg)
 
 
-def build_debs(distro, stack_name, os_platform, arch, staging_dir, force, noupload, interactive, repo_fqdn):
+def build_debs(distro, stack_name, os_platform, arch, staging_dir, force, noupload, interactive, repo_fqdn, backend='pbuilder', proxy=None, upload_queue=None, missing_depends=None):
     distro_name = distro.release_name
 
     if stack_name not in distro.released_stacks:
@@ -502,13 +537,15 @@ def build_debs(distro, stack_name, os_platform, arch, staging_dir, force, nouplo
 
     debug("Attempting to build: %s"%(str(stack_name)))
     #si = load_info(stack_name, stack_version)
-    missing_depends = list_missing.compute_missing_depends(stack_name, distro, os_platform, arch, repo = repo_url(repo_fqdn))
+    if missing_depends is None:
+        missing_depends = list_missing.compute_missing_depends(stack_name, distro, os_platform, arch, repo = repo_url(repo_fqdn))
     if not missing_depends:
         # Create the environment where we build the debs, if necessary
-        create_chroot(distro, distro_name, os_platform, arch, repo_fqdn)
+        with get_chroot_lock(os_platform, arch):
+            distro_tgz = create_chroot(distro, distro_name, os_platform, arch, repo_fqdn, backend, proxy)
         debug("Initiating build of: %s"%(str(stack_name)))
         try:
-            do_deb_build(distro_name, stack_name, stack_version, os_platform, arch, staging_dir, noupload, interactive, repo_fqdn)
+            do_deb_build(distro_name, stack_name, stack_version, os_platform, arch, staging_dir, noupload, interactive, repo_fqdn, distro_tgz, backend, proxy, upload_queue)
         except Exception, ex:
             debug("Exception was %s" % ex)
             debug("Build of [%s] failed, adding to broken list"%(str(stack_name)))
@@ -613,7 +650,7 @@ Description: Meta package for %(metapackage)s variant of ROS.
 
 
 
-def gen_metapkgs(distro, os_platform, arch, staging_dir, repo_fqdn, force=False):
+def gen_metapkgs(distro, os_platform, arch, staging_dir, repo_fqdn, force=False, upload_queue=None):
     distro_name = distro.release_name
 
     # Retrieve the package list from the shadow repo
@@ -663,13 +700,19 @@ def gen_metapkgs(distro, os_platform, arch, staging_dir, repo_fqdn, force=False)
     else:
         missing.append('all')
 
-    upload_binary_debs(debs, distro_name, os_platform, arch, repo_fqdn)
+    if debs:
+        queue = upload_queue or UploadQueue(repo_fqdn)
+        queue.add_debs(debs, os_platform)
+        if upload_queue is None:
+            queue.flush()
+    else:
+        debug("No debs to upload.")
 
     if missing:
         raise StackBuildFailure("Did not generate all metapkgs: %s."%missing)
 
 
-def gen_metapkgs_setup(staging_dir_arg, distro, os_platform, arch, repo_fqdn):
+def gen_metapkgs_setup(staging_dir_arg, distro, os_platform, arch, repo_fqdn, upload_queue=None):
     if staging_dir_arg is not None:
         staging_dir    = staging_dir_arg
         staging_dir = os.path.abspath(staging_dir)
@@ -680,7 +723,7 @@ def gen_metapkgs_setup(staging_dir_arg, distro, os_platform, arch, repo_fqdn):
     failure_message = None
 
     try:
-        gen_metapkgs(distro, os_platform, arch, staging_dir, repo_fqdn)
+        gen_metapkgs(distro, os_platform, arch, staging_dir, repo_fqdn, upload_queue=upload_queue)
     except BuildFailure, e:
         failure_message = "Failure Message:\n"+"="*80+'\n'+str(e)
     except StackBuildFailure, e:
@@ -694,10 +737,78 @@ def gen_metapkgs_setup(staging_dir_arg, distro, os_platform, arch, repo_fqdn):
     return warning_message, failure_message
 
 
+def get_max_jobs():
+    """
+    @return: number of builds which can run concurrently on this machine,
+      limited by the number of cores and the physical memory
+    """
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError):
+        return multiprocessing.cpu_count()
+    return max(1, min(multiprocessing.cpu_count(), memory // MEMORY_PER_BUILD))
+
+
+def build_target(distro, stack_name, os_platform, arch, staging_dir, options, upload_queue=None, missing_depends=None):
+    """
+    Build the debs of a stack for one platform and arch.
+    @param missing_depends: debian names of the missing dependencies of
+      the stack, computed by build_debs() if None
+    @return: (warning_message, failure_message)
+    """
+    warning_message = failure_message = None
+    try:
+        target_platforms = rosdeb.targets.os_platform[distro.release_name]
+        if os_platform not in target_platforms:
+            raise BuildFailure("[%s] is not a known platformfor distro %s.\nSupported platforms are: %s" % (os_platform, distro.release_name, ' '.join(target_platforms)))
+
+        if not os.path.exists(staging_dir):
+            debug("creating staging dir: %s"%(staging_dir))
+            os.makedirs(staging_dir)
+
+        if stack_name == 'metapackages':
+            (warning_message, failure_message) = gen_metapkgs_setup(staging_dir, distro, os_platform, arch, options.fqdn, upload_queue)
+        else:
+            build_debs(distro, stack_name, os_platform, arch, staging_dir, options.force, options.noupload, options.interactive, options.fqdn, options.backend, options.proxy, upload_queue, missing_depends)
+
+    except StackBuildFailure, e:
+        warning_message = "Warning Message:\n"+"="*80+'\n'+str(e)
+    except BuildFailure, e:
+        failure_message = "Failure Message:\n"+"="*80+'\n'+str(e)
+    except Exception, e:
+        failure_message = "Internal failure release system. Please notify ros-release@code.ros.org:\n%s\n\n%s"%(e, traceback.format_exc(e))
+    return warning_message, failure_message
+
+
+def get_build_levels(distro, targets):
+    """
+    Split the targets into levels of targets which can be built
+    concurrently: each stack comes after the stacks of the targets it
+    depends on and the metapackages come last.
+    @return: list of lists of targets
+    """
+    stacks = set([t[0] for t in targets if t[0] != 'metapackages'])
+    levels = {}
+    def get_level(s):
+        if s not in levels:
+            levels[s] = 0
+            try:
+                deps = [d for d, _ in compute_deps(distro, s) if d != s and d in stacks]
+            except BuildFailure:
+                # reported when the stack is built
+                deps = []
+            levels[s] = max([get_level(d) + 1 for d in deps] or [0])
+        return levels[s]
+    for s in stacks:
+        get_level(s)
+    levels['metapackages'] = max(levels.values() or [-1]) + 1
+    return [l for l in [[t for t in targets if levels[t[0]] == i] for i in range(levels['metapackages'] + 1)] if l]
+
+
 def single_deb_main():
 
     from optparse import OptionParser
-    parser = OptionParser(usage="usage: %prog <distro> <stack> <os-platform> <arch>", prog=NAME)
+    parser = OptionParser(usage="usage: %prog <distro> <stack>[,<stack>...] <os-platform>[,<os-platform>...] <arch>[,<arch>...]", prog=NAME)
 
     parser.add_option("-d", "--dir",
                       dest="staging_dir", default=None,
@@ -710,6 +821,15 @@ def single_deb_main():
                       dest="fqdn", default='50.28.27.175', action="store")
     parser.add_option("--interactive",
                       dest="interactive", default=False, action="store_true")
+    parser.add_option("--cowbuilder",
+                      dest="backend", default='pbuilder', action="store_const", const='cowbuilder',
+                      help="build in copy-on-write copies of an unpacked base directory instead of unpacking a base tarball")
+    parser.add_option("--http-proxy",
+                      dest="proxy", default=None, action="store",
+                      help="http proxy to download packages through, like the one of apt_cache_proxy.py")
+    parser.add_option("-j", "--jobs",
+                      dest="jobs", default=None, type="int",
+                      help="number of targets to build concurrently, by default as many as the cores and memory allow")
     parser.add_option('--smtp', dest="smtp", default='pub1.willowgarage.com', metavar="SMTP_SERVER")
 
     (options, args) = parser.parse_args()
@@ -717,8 +837,14 @@ def single_deb_main():
     if len(args) != 4:
         parser.error('invalid args')
 
-    (distro_name, stack_name, os_platform, arch) = args
-    distro = failure_message = warning_message = None
+    (distro_name, stack_names, os_platforms, arches) = args
+    targets = [(stack_name, os_platform, arch) for stack_name in stack_names.split(',') for os_platform in os_platforms.split(',') for arch in arches.split(',')]
+    if options.interactive and len(targets) > 1:
+        parser.error('--interactive can only build a single target')
+    distro = None
+    messages = {}
+    # the debs of each level of targets are uploaded together once they are built
+    upload_queue = None if options.noupload else UploadQueue(options.fqdn)
 
     if options.staging_dir is not None:
         staging_dir    = options.staging_dir
@@ -730,40 +856,68 @@ def single_deb_main():
     try:
         if distro_name not in rosdeb.targets.os_platform:
             raise BuildFailure("[%s] is not a known rosdistro.\nValid rosdistros are: %s" % (distro_name, ' '.join(rosdeb.targets.os_platform.keys())))
-        target_platforms = rosdeb.targets.os_platform[distro_name]
-        if os_platform not in target_platforms:
-            raise BuildFailure("[%s] is not a known platformfor distro %s.\nSupported platforms are: %s" % (os_platform, distro_name, ' '.join(target_platforms)))
-
-        if not os.path.exists(staging_dir):
-            debug("creating staging dir: %s"%(staging_dir))
-            os.makedirs(staging_dir)
 
         uri = distro_uri(distro_name)
         debug("loading distro file from %s"%(uri))
         distro = load_distro(uri)
 
-        if stack_name == 'metapackages':
-            (warning_message, failure_message) = gen_metapkgs_setup(options.staging_dir, distro, os_platform, arch, options.fqdn)
-        else:
-            build_debs(distro, stack_name, os_platform, arch, staging_dir, options.force, options.noupload, options.interactive, options.fqdn)
+        # the missing dependencies of all stacks of a platform and arch are computed at once
+        missing_depends = {}
+        for os_platform, arch in set([t[1:] for t in targets]):
+            stacks = set([t[0] for t in targets if t[1:] == (os_platform, arch) and t[0] in distro.released_stacks and t[0] in distro.stacks])
+            missing_depends[(os_platform, arch)] = list_missing.compute_missing_depends_batch(list(stacks), distro, os_platform, arch, repo = repo_url(options.fqdn))
+        # (deb_name, os_platform, arch) of the stacks uploaded by earlier levels
+        uploaded = set()
+
+        def build(target):
+            stack_name, os_platform, arch = target
+            missing = missing_depends[(os_platform, arch)].get(stack_name)
+            if missing is not None:
+                missing = set([d for d in missing if (d, os_platform, arch) not in uploaded])
+            # every target gets its own build place and results
+            target_dir = staging_dir if len(targets) == 1 else os.path.join(staging_dir, '-'.join(target))
+            return build_target(distro, stack_name, os_platform, arch, target_dir, options, upload_queue, missing)
+
+        # a stack is built against the debs of the stacks it depends on
+        # which are built in the same run, so they are uploaded first
+        for level in get_build_levels(distro, targets):
+            if len(level) == 1:
+                messages[level[0]] = build(level[0])
+            else:
+                pool = ThreadPool(min(options.jobs or get_max_jobs(), len(level)))
+                try:
+                    messages.update(zip(level, pool.map(build, level)))
+                finally:
+                    pool.close()
+                    pool.join()
+
+            if upload_queue:
+                if not upload_queue.flush():
+                    raise BuildFailure("Upload of debs failed")
+                for stack_name, os_platform, arch in level:
+                    if messages[(stack_name, os_platform, arch)] == (None, None):
+                        uploaded.add(("ros-%s-%s"%(distro.release_name, debianize_name(stack_name)), os_platform, arch))
 
-    except StackBuildFailure, e:
-        warning_message = "Warning Message:\n"+"="*80+'\n'+str(e)
     except BuildFailure, e:
-        failure_message = "Failure Message:\n"+"="*80+'\n'+str(e)
+        messages[None] = (None, "Failure Message:\n"+"="*80+'\n'+str(e))
     except Exception, e:
-        failure_message = "Internal failure release system. Please notify ros-release@code.ros.org:\n%s\n\n%s"%(e, traceback.format_exc(e))
+        messages[None] = (None, "Internal failure release system. Please notify ros-release@code.ros.org:\n%s\n\n%s"%(e, traceback.format_exc(e)))
     finally:
         # if we created our own staging dir, we are responsible for cleaning it up
         if options.staging_dir is None:
             shutil.rmtree(staging_dir)
 
 
-    if failure_message or warning_message:
+    failed = [target for target in [None] + targets if target in messages and (messages[target][0] or messages[target][1])]
+    for target in failed:
+        (warning_message, failure_message) = messages[target]
+        if target is not None and len(targets) > 1:
+            debug("TARGET: %s"%(' '.join(target)))
         debug("FAILURE: %s"%failure_message)
         debug("WARNING: %s"%warning_message)
 
-        if not options.interactive:
+        if not options.interactive and target is not None:
+            (stack_name, os_platform, arch) = target
             failure_message = "%s\n%s\n%s"%(failure_message, warning_message, os.environ.get('BUILD_URL', ''))
             if options.smtp and stack_name != 'metapackages' and distro is not None:
                 stack_version = distro.stacks[stack_name].version
@@ -773,6 +927,7 @@ def single_deb_main():
                     subject = 'debian build [%s-%s-%s-%s] failed'%(distro_name, stack_name, os_platform, arch)
                     # DISABLE SENDING OF EMAIL from script. This can be done better by jenkins.
                     # send_email(options.smtp, EMAIL_FROM_ADDR, to_addr, subject, failure_message)
+    if failed:
         sys.exit(1)
 
 